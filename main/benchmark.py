@@ -0,0 +1,529 @@
+import os
+import sys
+import json
+import base64
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import run_24
+from run_24 import CLONE_STRATEGIES, clone_repository, get_directory_size, scan_code_files, combine_code_files_to_markdown, get_language_by_extension, DirectorySource
+from run_24 import PDF_ENGINES, extract_pdf_pages, extract_texts_from_pdfs
+from run_24 import analyze_python_files, measure_coverage, get_file_token_counts, get_content_hash, estimate_tokens_batch, get_section_index_path, find_common_blocks
+
+
+def git(repo_dir, *args):
+    subprocess.run(["git", "-C", repo_dir] + list(args), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def build_test_repository(repo_dir, num_commits=20, num_code_files=200, num_assets=20, asset_size=512 * 1024):
+    # 코드 파일과 큰 바이너리 에셋이 섞인 히스토리를 가진 테스트 저장소 생성
+    os.makedirs(repo_dir, exist_ok=True)
+    git(repo_dir, "init", "--quiet")
+    git(repo_dir, "config", "user.email", "bench@example.com")
+    git(repo_dir, "config", "user.name", "bench")
+    # file:// 전송에서 partial clone 필터를 허용
+    git(repo_dir, "config", "uploadpack.allowFilter", "true")
+    git(repo_dir, "config", "uploadpack.allowAnySHA1InWant", "true")
+    for commit in range(num_commits):
+        for i in range(num_code_files):
+            path = os.path.join(repo_dir, "src", f"pkg{i % 10}", f"module_{i}.py")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(f"# revision {commit}\n" + "".join(f"def func_{i}_{n}(x):\n    return x + {n}\n\n" for n in range(20)))
+        for i in range(num_assets):
+            path = os.path.join(repo_dir, "assets", f"image_{i}.bin")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(asset_size))
+        git(repo_dir, "add", "-A")
+        git(repo_dir, "commit", "--quiet", "-m", f"revision {commit}")
+
+
+def bench_clone(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "origin")
+        print(f"Building test repository ({args.commits} commits)...")
+        build_test_repository(repo_dir, num_commits=args.commits)
+        repo_url = f"file://{repo_dir}"
+        run_24.MIRROR_CACHE_DIR = os.path.join(work_dir, "mirrors")
+
+        print(f"{'strategy':<10} {'git objects':>14} {'working tree':>14} {'wall time':>10}")
+        # 마지막 mirror 실행은 캐시 적중(증분 fetch) 경우
+        runs = [(strategy, strategy) for strategy in CLONE_STRATEGIES] + [("mirror-hit", "mirror")]
+        for label, strategy in runs:
+            dest_dir = os.path.join(work_dir, f"clone-{label}")
+            start = time.perf_counter()
+            errors = clone_repository(repo_url, dest_dir, [".py"], strategy)
+            elapsed = time.perf_counter() - start
+            if errors:
+                print(f"{label:<10} failed: {errors.strip()}")
+                continue
+            # mirror 전략은 객체를 캐시 미러에 두므로 그 크기를 전송량으로 본다
+            if strategy == "mirror":
+                object_bytes = get_directory_size(run_24.MIRROR_CACHE_DIR)
+            else:
+                object_bytes = get_directory_size(os.path.join(dest_dir, ".git"))
+            tree_bytes = get_directory_size(dest_dir) - get_directory_size(os.path.join(dest_dir, ".git"))
+            print(f"{label:<10} {object_bytes / 1024 ** 2:>11.1f} MB {tree_bytes / 1024 ** 2:>11.1f} MB {elapsed:>9.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_synthetic_tree(root, num_files=200000):
+    # 소스 코드 사이에 node_modules, 가상환경, 빌드 결과물이 섞인 트리 생성
+    layout = [("src", 0.15, ".py"), ("node_modules", 0.45, ".js"), (".venv/lib/site-packages", 0.25, ".py"), ("build", 0.10, ".o"), ("docs", 0.05, ".md")]
+    for top, share, ext in layout:
+        count = int(num_files * share)
+        for i in range(count):
+            directory = os.path.join(root, top, f"pkg{i % 200}", f"sub{i % 7}")
+            if i < 1400:
+                os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"file_{i}{ext}"), 'w') as f:
+                f.write("x = 1\n")
+
+
+def walk_baseline(root, file_extensions):
+    # 기존 방식: os.walk + 파일마다 any(endswith)
+    found = []
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            if any(file.endswith(ext) for ext in file_extensions):
+                found.append(os.path.relpath(os.path.join(dirpath, file), start=root))
+    return found
+
+
+def bench_walk(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        print(f"Building synthetic tree ({args.files} files)...")
+        build_synthetic_tree(work_dir, args.files)
+        file_extensions = [".py", ".js", ".java", ".c", ".cpp", ".h", ".kt", ".html", ".css", ".md", ".go", ".rs", ".ts", ".rb", ".php", ".cs", ".swift", ".ipynb", ".csproj"]
+        runs = [("os.walk + any(endswith)", lambda: walk_baseline(work_dir, file_extensions))]
+        for workers in (1, 4, 8):
+            runs.append((f"scan_code_files workers={workers}", lambda workers=workers: scan_code_files(work_dir, file_extensions, workers=workers)))
+        print(f"{'walker':<32} {'files':>8} {'wall time':>10}")
+        for label, run in runs:
+            start = time.perf_counter()
+            found = run()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<32} {len(found):>8} {elapsed:>9.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_synthetic_repo(root, total_mb, file_kb=256):
+    chunk = ("def function(x):\n    return x * 2\n\n" * (file_kb * 1024 // 36 + 1))[:file_kb * 1024]
+    files = []
+    for i in range(total_mb * 1024 // file_kb):
+        rel_path = f"pkg{i % 64}/module_{i}.py"
+        os.makedirs(os.path.join(root, os.path.dirname(rel_path)), exist_ok=True)
+        with open(os.path.join(root, rel_path), 'w') as f:
+            f.write(chunk)
+        files.append(rel_path)
+    return files
+
+
+def combine_baseline(repo_dir, downloaded_files, output_path):
+    # 기존 방식: 파일 전체를 문자열로 읽어 다시 쓰고, 구조 목록은 += 로 누적
+    repo_structure_content = ""
+    with open(output_path, 'w') as md_file:
+        md_file.write(f"# GitHub Repository: {repo_dir}\n\n")
+        md_file.write("## Repository Structure\n")
+        for file_path in downloaded_files:
+            md_file.write(f"- {file_path}\n")
+            repo_structure_content += f"- {file_path}\n"
+        md_file.write("\n")
+        for file_path in downloaded_files:
+            language = get_language_by_extension(file_path)
+            md_file.write(f"## File: {file_path}\n")
+            md_file.write(f"### Language: {language}\n")
+            md_file.write(f"### Description:\n")
+            md_file.write(f"This file contains the implementation of...\n\n")
+            md_file.write(f"### Code:\n")
+            md_file.write(f"```{language}\n")
+            with open(os.path.join(repo_dir, file_path), 'r') as code_file:
+                md_file.write(code_file.read())
+            md_file.write("\n```\n\n")
+    return repo_structure_content
+
+
+def run_merge_once(implementation, repo_dir, downloaded_files, output_dir):
+    # 별도 프로세스에서 실행해 최대 RSS를 구현별로 측정
+    start = time.perf_counter()
+    if implementation == "baseline":
+        os.makedirs(output_dir, exist_ok=True)
+        combine_baseline(repo_dir, downloaded_files, os.path.join(output_dir, "baseline.md"))
+    else:
+        # 쓰기 경로만 비교하도록 토큰 수 세기는 끈다
+        combine_code_files_to_markdown(repo_dir, downloaded_files, DirectorySource(repo_dir), output_dir, merge_options={"count_tokens": False})
+    elapsed = time.perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_merge(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "repo")
+        print(f"Building synthetic repository ({args.size_mb} MB)...")
+        downloaded_files = build_synthetic_repo(repo_dir, args.size_mb)
+        total_bytes = sum(os.path.getsize(os.path.join(repo_dir, path)) for path in downloaded_files)
+        print(f"{'writer':<10} {'throughput':>12} {'peak RSS':>10} {'wall time':>10}")
+        context = multiprocessing.get_context("spawn")
+        for implementation in ("baseline", "zero-copy"):
+            with context.Pool(1) as pool:
+                elapsed, peak_kb = pool.apply(run_merge_once, (implementation, repo_dir, downloaded_files, os.path.join(work_dir, implementation)))
+            print(f"{implementation:<10} {total_bytes / 1024 ** 2 / elapsed:>7.1f} MB/s {peak_kb / 1024:>7.1f} MB {elapsed:>9.2f}s")
+            shutil.rmtree(os.path.join(work_dir, implementation), ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_sample_pdfs(folder, num_pdfs=8, num_pages=30):
+    import fitz
+    paragraph = "We propose a method for learning representations of source code. " * 12
+    for i in range(num_pdfs):
+        document = fitz.open()
+        for page_number in range(num_pages):
+            page = document.new_page()
+            page.insert_textbox(fitz.Rect(72, 72, 540, 770), f"Section {page_number}\n" + paragraph * 4, fontsize=9)
+        document.save(os.path.join(folder, f"sample_{i}.pdf"))
+        document.close()
+
+
+def bench_pdf(args):
+    work_dir = None
+    folder = args.folder
+    if folder is None:
+        work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+        folder = work_dir
+        print("Generating sample PDFs...")
+        build_sample_pdfs(folder)
+    try:
+        pdf_contents = []
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(".pdf"):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    pdf_contents.append(f.read())
+        print(f"{len(pdf_contents)} PDFs, {sum(map(len, pdf_contents)) / 1024 ** 2:.1f} MB")
+        print(f"{'engine':<24} {'output chars':>13} {'wall time':>10}")
+        for engine in PDF_ENGINES:
+            start = time.perf_counter()
+            texts = [extract_pdf_pages(pdf_bytes, 0, None, engine) for pdf_bytes in pdf_contents]
+            elapsed = time.perf_counter() - start
+            print(f"{engine + ' (sequential)':<24} {sum(map(len, texts)):>13} {elapsed:>9.2f}s")
+            # 프로세스 풀 준비 시간은 제외
+            extract_texts_from_pdfs(pdf_contents[:2], engine)
+            start = time.perf_counter()
+            texts = extract_texts_from_pdfs(pdf_contents, engine)
+            elapsed = time.perf_counter() - start
+            print(f"{engine + ' (process pool)':<24} {sum(len(text or '') for text in texts):>13} {elapsed:>9.2f}s")
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_python_repo(root, num_files):
+    function = "def handler_{n}(request, mode):\n" + "".join(f"    if mode == {j}:\n        for item in request:\n            if item and item % {j + 2}:\n                yield item\n" for j in range(12)) + "    return None\n\n"
+    file_paths = []
+    for i in range(num_files):
+        rel_path = f"pkg{i % 32}/module_{i}.py"
+        os.makedirs(os.path.join(root, os.path.dirname(rel_path)), exist_ok=True)
+        with open(os.path.join(root, rel_path), 'w') as f:
+            f.write("".join(function.format(n=n) for n in range(20)))
+        file_paths.append(rel_path)
+    return file_paths
+
+
+def bench_core(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        print(f"Building synthetic Python repository ({args.files} files)...")
+        file_paths = build_python_repo(work_dir, args.files)
+        source = DirectorySource(work_dir)
+        print(f"{'workers':>7} {'wall time':>10} {'speedup':>8}")
+        baseline = None
+        for workers in (1, 2, 4, 8):
+            context = multiprocessing.get_context("forkserver")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                # 워커 시작 시간은 제외
+                list(pool.map(abs, range(workers)))
+                start = time.perf_counter()
+                analyze_python_files(source, file_paths, pool=pool, workers=workers, use_cache=False)
+                elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{workers:>7} {elapsed:>9.2f}s {baseline / elapsed:>7.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_tested_repo(root, num_modules, hanging=False):
+    # 모듈마다 함수 두 개 중 하나만 테스트하는 작은 패키지 (파일별 커버리지가 100%보다 낮게 나온다)
+    file_paths = []
+    os.makedirs(os.path.join(root, "pkg"))
+    os.makedirs(os.path.join(root, "tests"))
+    with open(os.path.join(root, "pkg", "__init__.py"), 'w'):
+        pass
+    file_paths.append("pkg/__init__.py")
+    for i in range(num_modules):
+        with open(os.path.join(root, "pkg", f"module_{i}.py"), 'w') as f:
+            f.write(f"def tested(x):\n    return x + {i}\n\n\ndef untested(x):\n    y = x * 2\n    return y - {i}\n")
+        with open(os.path.join(root, "tests", f"test_module_{i}.py"), 'w') as f:
+            f.write(f"from pkg.module_{i} import tested\n\n\ndef test_tested():\n    assert tested(1) == {i + 1}\n")
+        file_paths += [f"pkg/module_{i}.py", f"tests/test_module_{i}.py"]
+    if hanging:
+        with open(os.path.join(root, "tests", "test_hanging.py"), 'w') as f:
+            f.write("import time\n\n\ndef test_hanging():\n    time.sleep(3600)\n")
+        file_paths.append("tests/test_hanging.py")
+    return file_paths
+
+
+def bench_coverage(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "repo")
+        print(f"Building tested Python repository ({args.modules} modules)...")
+        file_paths = build_tested_repo(repo_dir, args.modules, hanging=args.hanging)
+        source = DirectorySource(repo_dir)
+        if args.hanging:
+            run_24.COVERAGE_TIMEOUT = args.timeout
+        print(f"{'workers':>7} {'wall time':>10} {'files':>6} {'mean coverage':>14} {'timeouts':>9}")
+        for workers in (1, 2, 4):
+            workspace = os.path.join(work_dir, f"workspace-{workers}")
+            start = time.perf_counter()
+            ratios, stats = measure_coverage(source, file_paths, repo_dir, workspace, workers=workers)
+            elapsed = time.perf_counter() - start
+            mean = sum(ratios.values()) / len(ratios) if ratios else 0.0
+            print(f"{workers:>7} {elapsed:>9.2f}s {len(ratios):>6} {mean:>13.1%} {stats['timeouts']:>9}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare_token_counts(source, file_paths, counts, encoding_name):
+    # 추정치를 tiktoken 인코딩의 실제 토큰 수와 비교한다 (tiktoken과 인코딩 파일이 있어야 함)
+    import tiktoken
+    encoding = tiktoken.get_encoding(encoding_name)
+    reference = {file_path: len(encoding.encode(source.read(file_path).decode('utf-8', errors='replace'), disallowed_special=())) for file_path in file_paths}
+    errors = sorted(abs(counts[file_path] - reference[file_path]) / reference[file_path] for file_path in file_paths if reference[file_path])
+    if not errors:
+        return
+    total_reference = sum(reference.values())
+    total_estimate = sum(counts[file_path] for file_path in file_paths)
+    print(f"Reference {encoding_name}: {total_reference} tokens, estimate/reference {total_estimate / total_reference:.3f}")
+    print(f"Per-file absolute error: mean {sum(errors) / len(errors):.1%}, median {errors[len(errors) // 2]:.1%}, p90 {errors[int(len(errors) * 0.9)]:.1%}")
+
+
+def bench_tokens(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        if args.folder:
+            root = args.folder
+            file_paths = scan_code_files(root, [".py", ".js", ".ts", ".java", ".c", ".cpp", ".h", ".go", ".rs", ".md"])
+        else:
+            root = os.path.join(work_dir, "repo")
+            print(f"Building synthetic Python repository ({args.files} files)...")
+            file_paths = build_python_repo(root, args.files)
+        run_24.METRICS_CACHE_PATH = os.path.join(work_dir, "metrics.sqlite3")
+        source = DirectorySource(root)
+        total_bytes = sum(source.size(file_path) for file_path in file_paths)
+        # Merge에서는 extraction manifest가 해시를 주므로 측정에서 뺀다
+        file_hashes = {file_path: get_content_hash(source.read(file_path)) for file_path in file_paths}
+        print(f"{'run':<6} {'tokens':>12} {'bytes/token':>12} {'wall time':>10} {'throughput':>12}")
+        for label in ("cold", "cached"):
+            start = time.perf_counter()
+            counts = get_file_token_counts(source, file_paths, file_hashes)
+            elapsed = time.perf_counter() - start
+            tokens = sum(counts.values())
+            print(f"{label:<6} {tokens:>12} {total_bytes / max(tokens, 1):>12.2f} {elapsed:>9.2f}s {total_bytes / elapsed / 1024 ** 2:>7.1f} MB/s")
+        if args.reference:
+            compare_token_counts(source, file_paths, counts, args.reference)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def build_notebook_repo(root, num_notebooks, image_kb=200):
+    # 코드/마크다운 셀에 표준 출력, base64 PNG, HTML 표 출력이 붙은 데이터 분석 노트북들
+    files = []
+    for i in range(num_notebooks):
+        cells = [{"cell_type": "markdown", "metadata": {}, "source": [f"# Experiment {i}\n", "Results are plotted below.\n"]}]
+        for n in range(12):
+            outputs = [{"name": "stdout", "output_type": "stream", "text": [f"epoch {k}: loss {1 / (k + 1):.4f}\n" for k in range(40)]}]
+            if n % 3 == 0:
+                image = base64.b64encode(os.urandom(image_kb * 1024)).decode('ascii')
+                outputs.append({"data": {"image/png": image, "text/plain": ["<Figure size 640x480 with 1 Axes>"]}, "metadata": {}, "output_type": "display_data"})
+            outputs.append({"data": {"text/html": ["<table>" + "<tr><td>0.5</td><td>0.25</td></tr>" * 100 + "</table>"], "text/plain": [f"   loss  acc\n0  {n}  0.9"]}, "execution_count": n, "metadata": {}, "output_type": "execute_result"})
+            cells.append({"cell_type": "code", "execution_count": n, "metadata": {}, "outputs": outputs, "source": [f"model_{n} = train(data, epochs={n + 1})\n", f"plot(model_{n}.history)"]})
+        notebook = {"cells": cells, "metadata": {"kernelspec": {"display_name": "Python 3", "language": "python", "name": "python3"}}, "nbformat": 4, "nbformat_minor": 5}
+        rel_path = f"notebooks/experiment_{i}.ipynb"
+        os.makedirs(os.path.join(root, os.path.dirname(rel_path)), exist_ok=True)
+        with open(os.path.join(root, rel_path), 'w') as f:
+            json.dump(notebook, f, indent=1)
+        files.append(rel_path)
+    return files
+
+
+def bench_notebooks(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "repo")
+        print(f"Building synthetic notebook repository ({args.notebooks} notebooks)...")
+        downloaded_files = build_notebook_repo(repo_dir, args.notebooks)
+        run_24.METRICS_CACHE_PATH = os.path.join(work_dir, "metrics.sqlite3")
+        # Merge는 기본으로 토큰 수도 세므로 두 방식 모두 문서의 토큰 수 추정까지 포함해 잰다
+        print(f"{'merge':<10} {'output':>12} {'tokens':>10} {'wall time':>10}")
+        for implementation in ("verbatim", "notebook"):
+            output_dir = os.path.join(work_dir, implementation)
+            start = time.perf_counter()
+            if implementation == "verbatim":
+                os.makedirs(output_dir, exist_ok=True)
+                output_path = os.path.join(output_dir, "baseline.md")
+                combine_baseline(repo_dir, downloaded_files, output_path)
+                with open(output_path, 'rb') as f:
+                    tokens = estimate_tokens_batch([f.read()])[0]
+            else:
+                combine_code_files_to_markdown(repo_dir, downloaded_files, DirectorySource(repo_dir), output_dir, merge_options={"notebook_output_chars": args.output_chars})
+                output_path = os.path.join(output_dir, "merged", "repo.md")
+                with open(get_section_index_path(output_path)) as f:
+                    tokens = sum(section["tokens"] for section in json.load(f)["sections"])
+            elapsed = time.perf_counter() - start
+            print(f"{implementation:<10} {os.path.getsize(output_path) / 1024 ** 2:>9.2f} MB {tokens:>10} {elapsed:>9.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_normalize(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        run_24.METRICS_CACHE_PATH = os.path.join(work_dir, "metrics.sqlite3")
+        file_paths = scan_code_files(args.folder, [".py", ".js", ".ts", ".java", ".c", ".cpp", ".h", ".go", ".rs", ".css", ".html", ".md"])
+        source = DirectorySource(args.folder)
+        print(f"{'merge':<10} {'output':>12} {'tokens':>10} {'wall time':>10}")
+        for normalize in (False, True):
+            label = "normalized" if normalize else "verbatim"
+            start = time.perf_counter()
+            message, _ = combine_code_files_to_markdown(args.folder, file_paths, source, os.path.join(work_dir, label), merge_options={"normalize": normalize})
+            elapsed = time.perf_counter() - start
+            output_path = message.splitlines()[0].split(": ", 1)[1]
+            with open(get_section_index_path(output_path)) as f:
+                tokens = sum(section["tokens"] for section in json.load(f)["sections"])
+            print(f"{label:<10} {os.path.getsize(output_path) / 1024 ** 2:>9.2f} MB {tokens:>10} {elapsed:>9.2f}s")
+        # 언어별 절감량은 Merge 메시지의 마지막 부분
+        lines = message.splitlines()
+        print("\n".join(lines[next(i for i, line in enumerate(lines) if line.startswith("Normalization")):]))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+LICENSE_HEADERS = [
+    "# Copyright 2024 The Example Authors. All rights reserved.\n#\n# Licensed under the Apache License, Version 2.0 (the \"License\");\n"
+    "# you may not use this file except in compliance with the License.\n# You may obtain a copy of the License at\n#\n"
+    "#     http://www.apache.org/licenses/LICENSE-2.0\n#\n# Unless required by applicable law or agreed to in writing, software\n"
+    "# distributed under the License is distributed on an \"AS IS\" BASIS,\n# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.\n"
+    "# See the License for the specific language governing permissions and\n# limitations under the License.\n\n",
+    "# This file is part of Example.\n#\n# Example is free software: you can redistribute it and/or modify it under the terms of the\n"
+    "# GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or\n"
+    "# (at your option) any later version.\n\n",
+    "# Code generated by example-codegen. DO NOT EDIT.\n# source: api/v1/service.proto\n# Regenerate with `make generate` after changing the schema.\n\n",
+]
+
+
+def build_licensed_repo(root, num_files):
+    # 파일 대부분이 몇 가지 라이선스/자동 생성 머리말 중 하나로 시작하고, 일부는 같은 꼬리말로 끝나는 저장소
+    footer = "\n\nif __name__ == \"__main__\":\n    import sys\n    sys.exit(main(sys.argv[1:]) or 0)  # keep in sync with the console script entry point\n"
+    files = []
+    for i in range(num_files):
+        rel_path = f"pkg{i % 100}/module_{i}.py"
+        os.makedirs(os.path.join(root, os.path.dirname(rel_path)), exist_ok=True)
+        header = LICENSE_HEADERS[i % len(LICENSE_HEADERS)] if i % 10 else ""
+        body = "".join(f"def func_{i}_{n}(x):\n    return x + {n}\n\n" for n in range(10))
+        with open(os.path.join(root, rel_path), 'w') as f:
+            f.write(header + body + (footer if i % 4 == 0 else ""))
+        files.append(rel_path)
+    return files
+
+
+def bench_headers(args):
+    work_dir = tempfile.mkdtemp(prefix="codecollector-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "repo")
+        print(f"Building synthetic repository with license headers ({args.files} files)...")
+        downloaded_files = build_licensed_repo(repo_dir, args.files)
+        source = DirectorySource(repo_dir)
+        print(f"{'files':>7} {'scan':>8} {'blocks':>7} {'files with refs':>16}")
+        for count in (args.files // 4, args.files // 2, args.files):
+            start = time.perf_counter()
+            common_blocks = find_common_blocks(source, downloaded_files[:count])
+            elapsed = time.perf_counter() - start
+            print(f"{count:>7} {elapsed:>7.2f}s {len(common_blocks.blocks):>7} {len(common_blocks.assignments):>16}")
+        print(f"{'merge':<10} {'output':>12} {'wall time':>10}")
+        for dedupe in (False, True):
+            label = "deduped" if dedupe else "verbatim"
+            start = time.perf_counter()
+            combine_code_files_to_markdown(repo_dir, downloaded_files, source, os.path.join(work_dir, label), merge_options={"count_tokens": False, "dedupe_headers": dedupe})
+            elapsed = time.perf_counter() - start
+            print(f"{label:<10} {os.path.getsize(os.path.join(work_dir, label, 'merged', 'repo.md')) / 1024 ** 2:>9.2f} MB {elapsed:>9.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CodeCollector benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    clone_parser = subparsers.add_parser("clone", help="Compare clone strategies against a local file:// repository")
+    clone_parser.add_argument("--commits", type=int, default=20)
+    clone_parser.set_defaults(func=bench_clone)
+
+    walk_parser = subparsers.add_parser("walk", help="Compare os.walk with scan_code_files on a synthetic tree")
+    walk_parser.add_argument("--files", type=int, default=200000)
+    walk_parser.set_defaults(func=bench_walk)
+
+    merge_parser = subparsers.add_parser("merge", help="Compare the merge writers on a synthetic repository")
+    merge_parser.add_argument("--size-mb", type=int, default=2048)
+    merge_parser.set_defaults(func=bench_merge)
+
+    pdf_parser = subparsers.add_parser("pdf", help="Compare PDF text extraction engines")
+    pdf_parser.add_argument("--folder", help="Folder of sample PDFs (generated when omitted)")
+    pdf_parser.set_defaults(func=bench_pdf)
+
+    core_parser = subparsers.add_parser("core", help="Measure core code analysis scaling over worker counts")
+    core_parser.add_argument("--files", type=int, default=500)
+    core_parser.set_defaults(func=bench_core)
+
+    coverage_parser = subparsers.add_parser("coverage", help="Measure sandboxed coverage runs over worker counts")
+    coverage_parser.add_argument("--modules", type=int, default=40)
+    coverage_parser.add_argument("--hanging", action="store_true", help="Add a test that never finishes to exercise the timeout")
+    coverage_parser.add_argument("--timeout", type=float, default=10)
+    coverage_parser.set_defaults(func=bench_coverage)
+
+    tokens_parser = subparsers.add_parser("tokens", help="Measure the token estimator and its cache")
+    tokens_parser.add_argument("--folder", help="Folder of source files (a synthetic repository when omitted)")
+    tokens_parser.add_argument("--files", type=int, default=2000)
+    tokens_parser.add_argument("--reference", help="Also compare with a tiktoken encoding, e.g. cl100k_base")
+    tokens_parser.set_defaults(func=bench_tokens)
+
+    notebooks_parser = subparsers.add_parser("notebooks", help="Compare verbatim and notebook-aware merging of .ipynb files")
+    notebooks_parser.add_argument("--notebooks", type=int, default=50)
+    notebooks_parser.add_argument("--output-chars", type=int, default=0, help="Text output characters kept per cell")
+    notebooks_parser.set_defaults(func=bench_notebooks)
+
+    normalize_parser = subparsers.add_parser("normalize", help="Measure source normalization savings per language on a folder")
+    normalize_parser.add_argument("--folder", required=True)
+    normalize_parser.set_defaults(func=bench_normalize)
+
+    headers_parser = subparsers.add_parser("headers", help="Measure common header detection and deduplicated merging")
+    headers_parser.add_argument("--files", type=int, default=40000)
+    headers_parser.set_defaults(func=bench_headers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,152 +1,2266 @@
+import io
 import os
 import re
+import sys
+import math
+import heapq
+import time
+import fcntl
+import signal
+import json
+import mmap
+import errno
+import zlib
+import hashlib
+import sqlite3
 import subprocess
 import tempfile
+import threading
+import asyncio
+import multiprocessing
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import gradio as gr
 import shutil
 import ast
+import tokenize
+import importlib.util
 import coverage
-import urllib.error
+import urllib.parse
 import fitz  # PyMuPDF
-import wget
+import httpx
 from pdfminer.high_level import extract_text
-from radon.complexity import cc_visit
-from modulegraph.modulegraph import ModuleGraph
+import radon
+from radon.complexity import cc_visit_ast
+from radon.raw import analyze as raw_analyze
 import requests  
 
 
-def clear_download_folder():
-    download_dir = os.path.join(os.getcwd(), "down_code")
+# 저장소 미러 캐시 설정
+MIRROR_CACHE_DIR = os.environ.get("CODECOLLECTOR_MIRROR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "codecollector", "mirrors"))
+MIRROR_CACHE_MAX_BYTES = int(os.environ.get("CODECOLLECTOR_MIRROR_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+# 저장소를 가져오는 방식: mirror(캐시), shallow(depth 1), blobless(blob 필터), sparse(확장자 기반 sparse checkout)
+CLONE_STRATEGIES = ["mirror", "shallow", "blobless", "sparse"]
+
+# 파일 탐색 시 통째로 건너뛸 디렉터리 (의존성, 가상환경, 빌드 결과물 등)
+PRUNE_DIRS = set(filter(None, os.environ.get("CODECOLLECTOR_PRUNE_DIRS", ".git,.hg,.svn,node_modules,bower_components,__pycache__,.venv,venv,env,.tox,.nox,.mypy_cache,.pytest_cache,.ruff_cache,.eggs,.idea,.vscode,build,dist,target,.next,.gradle").split(',')))
+# git에 커밋된 파일 목록(미러 트리, clone 결과)에서는 버전 관리 디렉터리만 건너뛴다. 커밋된 build/, env/ 등은 소스일 수 있다
+VCS_DIRS = {".git", ".hg", ".svn"}
+SCAN_WORKERS = int(os.environ.get("CODECOLLECTOR_SCAN_WORKERS", 1))
+
+# 병합 시 파일 섹션을 렌더링할 스레드 수. 이보다 큰 파일은 읽지 않고 커널 복사로 이어 붙임
+MERGE_WORKERS = int(os.environ.get("CODECOLLECTOR_MERGE_WORKERS", 8))
+MERGE_INLINE_MAX_BYTES = 4 * 1024 * 1024
+
+# arXiv PDF 다운로드 설정 (호스트당 동시 연결 수, 타임아웃, 재시도)
+ARXIV_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("CODECOLLECTOR_ARXIV_CONNECTIONS", 4))
+ARXIV_TIMEOUT = float(os.environ.get("CODECOLLECTOR_ARXIV_TIMEOUT", 30))
+ARXIV_RETRIES = 3
+ARXIV_BACKOFF = 1.0
+
+# 추출한 arXiv 본문 캐시 (논문 ID + 버전 단위, zlib 압축, LRU)
+ARXIV_CACHE_DIR = os.environ.get("CODECOLLECTOR_ARXIV_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "codecollector", "arxiv"))
+ARXIV_CACHE_MAX_BYTES = int(os.environ.get("CODECOLLECTOR_ARXIV_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+ARXIV_LINK_PATTERN = re.compile(r'arxiv\.org/(?:abs|pdf)/(\d{4}\.\d{4,5}|[a-z][a-z.\-]*/\d{7})(v\d+)?', re.IGNORECASE)
+
+# PDF 본문 추출 엔진(pymupdf 또는 pdfminer)과 큰 PDF를 나눠 처리할 페이지 단위
+PDF_ENGINE = os.environ.get("CODECOLLECTOR_PDF_ENGINE", "pymupdf")
+PDF_PAGES_PER_TASK = 16
+
+# 논문 본문에서 인식하는 섹션 제목과 대표 이름
+PDF_SECTION_NAMES = {
+    "abstract": "abstract",
+    "introduction": "introduction",
+    "related work": "related work",
+    "background": "background",
+    "preliminaries": "background",
+    "method": "method",
+    "methods": "method",
+    "methodology": "method",
+    "approach": "method",
+    "proposed method": "method",
+    "experiments": "experiments",
+    "experimental results": "experiments",
+    "evaluation": "experiments",
+    "results": "experiments",
+    "discussion": "discussion",
+    "conclusion": "conclusion",
+    "conclusions": "conclusion",
+    "acknowledgments": "references",
+    "acknowledgements": "references",
+    "references": "references",
+    "bibliography": "references",
+    "appendix": "appendix",
+    "appendices": "appendix",
+    "supplementary material": "appendix",
+}
+PDF_SECTION_CHOICES = ["title", "abstract", "introduction", "related work", "background", "method", "experiments", "discussion", "conclusion"]
+PDF_HEADING_PATTERN = re.compile(r'^\s*(?:(?:\d+(?:\.\d+)*|[IVX]+|[A-H])\.?\s+)?(' + '|'.join(sorted(map(re.escape, PDF_SECTION_NAMES), key=len, reverse=True)) + r')\s*:?\s*$', re.IGNORECASE)
+
+# CPU 작업(PDF 추출, 코드 분석)에 쓰는 프로세스 풀 크기
+PROCESS_WORKERS = int(os.environ.get("CODECOLLECTOR_PROCESS_WORKERS", os.cpu_count() or 1))
+
+# 핵심 코드 판정 기준과 분석 시 한 번에 읽어 들이는 파일 수
+CORE_COMPLEXITY_THRESHOLD = 25
+ANALYSIS_BATCH_SIZE = 512
+
+# 저장소 내부 import 그래프: 이 수보다 많은 파일이 import하는 파일은 핵심 코드로 본다. PageRank 감쇠 계수
+CORE_FAN_IN_THRESHOLD = int(os.environ.get("CODECOLLECTOR_CORE_FAN_IN_THRESHOLD", 5))
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 100
+
+# 커버리지 측정: 저장소 코드를 격리된 하위 프로세스에서 실행. 작업당 제한 시간(초)과 메모리 상한(바이트)
+COVERAGE_WORKERS = int(os.environ.get("CODECOLLECTOR_COVERAGE_WORKERS", PROCESS_WORKERS))
+COVERAGE_TIMEOUT = float(os.environ.get("CODECOLLECTOR_COVERAGE_TIMEOUT", 300))
+COVERAGE_MEMORY_LIMIT = int(os.environ.get("CODECOLLECTOR_COVERAGE_MEMORY_LIMIT", 4 * 1024 ** 3))
+CORE_COVERAGE_THRESHOLD = 0.9
+TEST_FILE_PATTERN = re.compile(r'(^|/)(test_[^/]*|[^/]*_test)\.py$|(^|/)tests?/[^/]*\.py$')
+
+# 파일 내용 해시 + 분석기 버전을 키로 하는 분석 결과 캐시 (SQLite)
+METRICS_CACHE_PATH = os.environ.get("CODECOLLECTOR_METRICS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "codecollector", "metrics.sqlite3"))
+ANALYZER_VERSION = f"radon-{radon.__version__}/2"
+
+# 핵심 파일 점수의 가중치 (커버리지를 측정하지 않으면 나머지 가중치로 다시 나눈다)
+CORE_SCORE_WEIGHTS = {
+    "complexity": 0.4,
+    "centrality": 0.3,
+    "size": 0.1,
+    "coverage": 0.2,
+}
+# 예산 안에서 파일 고르는 방법: 점수 합을 최대화하는 knapsack, 또는 점수 높은 순으로 채우는 top-k
+CORE_SELECTION_METHODS = ["knapsack", "top-k"]
+CORE_BUDGET_UNITS = ["tokens", "bytes"]
+KNAPSACK_RESOLUTION = 2000
+
+# functions 단위: 복잡도가 이 값을 넘는 함수만 본문을 남기고 나머지는 시그니처로 줄인다 (radon 등급 C 이상)
+CORE_GRANULARITIES = ["files", "functions"]
+CORE_FUNCTION_COMPLEXITY_THRESHOLD = 10
+
+# Extract Core Code 기본 옵션. budget이 0(기본값)이면 예산 없이 기준값(복잡도, fan-in, 커버리지)으로 고른다
+DEFAULT_CORE_OPTIONS = {
+    "budget": 0,
+    "budget_unit": "tokens",
+    "selection": "knapsack",
+    "granularity": "files",
+    "measure_coverage": False,
+}
+
+# Merge 출력 방식: 전체 코드, 또는 시그니처/docstring/상수만 남긴 skeleton
+MERGE_OUTPUT_MODES = ["full", "skeleton"]
+
+# skeleton을 만들 수 있는 중괄호 언어. 값은 문자열 따옴표 (그 밖의 작은따옴표는 문자 리터럴)
+BRACE_LANGUAGE_QUOTES = {
+    '.js': '"\'`',
+    '.ts': '"\'`',
+    '.php': '"\'',
+    '.java': '"',
+    '.c': '"',
+    '.cpp': '"',
+    '.h': '"',
+    '.kt': '"',
+    '.go': '"`',
+    '.rs': '"',
+    '.cs': '"',
+    '.swift': '"',
+}
+# 본문을 생략하지 않고 안을 들여다보는 블록 (클래스, 네임스페이스 등)
+BRACE_CONTAINER_PATTERN = re.compile(
+    r'^(?:@\w+(?:\([^)]*\))?\s*)*'
+    r'(?:(?:public|private|protected|internal|static|final|abstract|sealed|open|data|export|default|declare|pub(?:\([^)]*\))?|unsafe|partial|typedef|template\s*<[^>]*>)\s+)*'
+    r'(?:type\s+\w+(?:\[[^\]]*\])?\s+)?'
+    r'(class|struct|union|enum|interface|namespace|module|trait|impl|object|extension|protocol|record|extern|use|import|export)\b'
+)
+
+# 노트북(.ipynb)은 코드/마크다운 셀만 "# %%" 형식으로 렌더링한다. 마크다운 셀과 텍스트 출력은 커널 언어의 주석으로 넣는다
+NOTEBOOK_COMMENT_PREFIXES = {
+    'python': '#',
+    'r': '#',
+    'julia': '#',
+    'ruby': '#',
+    'bash': '#',
+    'javascript': '//',
+    'typescript': '//',
+    'java': '//',
+    'scala': '//',
+    'kotlin': '//',
+    'c++': '//',
+    'csharp': '//',
+    'c#': '//',
+    'go': '//',
+    'rust': '//',
+    'sql': '--',
+    'haskell': '--',
+    'matlab': '%',
+    'octave': '%',
+}
+NOTEBOOK_REPORT_LIMIT = 20
+# JSON을 디코딩하지 않고 훑기 위한 토큰. 문자열은 여는 따옴표만 찾고 끝은 bytes.find로 찾아 긴 base64도 빠르게 건너뛴다
+JSON_TOKEN_PATTERN = re.compile(rb'\s*(["{}\[\]:,]|[^\s{}\[\]:,"]+)')
+JSON_NESTING_PATTERN = re.compile(rb'["{}\[\]]')
+
+# 정규화(선택): 주석 제거, 줄 끝 공백과 연속된 빈 줄 정리, 줄바꿈 통일, 압축(minified) 번들 생략.
+# 주석은 파이썬은 tokenize로, 중괄호 언어는 skeleton과 같은 토큰 패턴으로 찾는다.
+# CSS에는 // 주석이 없으므로 (url(http://...)) /* */ 주석과 문자열만 찾는 패턴을 따로 쓴다
+NORMALIZE_COMMENT_QUOTES = {**BRACE_LANGUAGE_QUOTES, '.tsx': '"\'`'}
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+# 압축 번들 검사는 번들이나 생성된 데이터가 흔한 확장자에만 한다 (.md 같은 문서는 한 줄 문단이 길 수 있다)
+MINIFIED_EXTENSIONS = {'.js', '.mjs', '.cjs', '.jsx', '.ts', '.tsx', '.css', '.scss', '.less', '.json', '.map'}
+MINIFIED_MIN_BYTES = 2048
+MINIFIED_AVERAGE_LINE_LENGTH = 250
+BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+TRAILING_WHITESPACE_PATTERN = re.compile(r'[ \t\f\v]+$', re.MULTILINE)
+
+# 여러 파일에 반복되는 머리말/꼬리말(라이선스, 자동 생성 문구) 찾기: 파일 앞뒤에서 읽을 바이트와 줄 수,
+# 공통 블록으로 볼 최소 파일 수와 크기, 줄 단위 rolling hash의 밑과 법
+HEADER_SCAN_BYTES = 8 * 1024
+HEADER_MAX_LINES = 100
+HEADER_MIN_FILES = 3
+HEADER_MIN_BYTES = 128
+HEADER_HASH_BASE = 1000003
+HEADER_HASH_MODULUS = (1 << 61) - 1
+
+# 토큰 수 추정: BPE 토크나이저의 사전 분할 규칙을 흉내 낸 근사치. 문자 종류별 조각 수에 가중치를 준다.
+# 가중치는 손으로 정한 값이며 실제 토크나이저에 맞춰 보정(fit)하지 않았다. benchmark.py tokens --reference로 오차를 잴 수 있다
+TOKEN_ESTIMATOR_VERSION = "pretokenize/1"
+TOKEN_WORD_CHARS = 6
+TOKEN_DIGIT_CHARS = 3
+TOKEN_PUNCTUATION_WEIGHT = 0.8
+TOKEN_NON_ASCII_BYTES = 2.0
+# 한 번에 세는 바이트 수. 구간(run) 배열이 입력의 몇 배까지 커질 수 있어 작게 둔다
+TOKEN_BATCH_BYTES = 4 * 1024 * 1024
+
+# Merge to Markdown 기본 옵션 (UI에서 바꿀 수 있음). count_tokens는 섹션 색인에 토큰 수를 기록하고,
+# shard_tokens가 0보다 크면 그 토큰 수 이하의 파일들로 나눈다 (토큰 수를 항상 센다).
+# normalize는 파일 내용을 정규화하고, dedupe_headers는 반복되는 머리말/꼬리말을 "Common headers" 섹션에 한 번만 쓴다 (둘 다 기본 꺼짐: 원문 그대로).
+# notebook_output_chars가 0이면 노트북 출력을 모두 버리고, 0보다 크면 텍스트 출력만 셀마다 그 길이로 잘라 남긴다
+DEFAULT_MERGE_OPTIONS = {
+    "arxiv_max_pages": 0,
+    "arxiv_sections": [],
+    "arxiv_drop_references": False,
+    "output_mode": "full",
+    "notebook_output_chars": 0,
+    "normalize": False,
+    "dedupe_headers": False,
+    "count_tokens": True,
+    "shard_tokens": 0,
+}
+
+# 작업(세션)별 격리된 작업 공간. tmpfs(/dev/shm 등)를 지정할 수 있음
+WORKSPACE_ROOT = os.environ.get("CODECOLLECTOR_WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "codecollector"))
+WORKSPACE_MAX_AGE = int(os.environ.get("CODECOLLECTOR_WORKSPACE_MAX_AGE", 6 * 60 * 60))
+
+# 작업 큐 설정: 동시에 실행할 작업 수와 대기할 수 있는 작업 수
+JOB_WORKERS = int(os.environ.get("CODECOLLECTOR_JOB_WORKERS", 2))
+JOB_QUEUE_DEPTH = int(os.environ.get("CODECOLLECTOR_JOB_QUEUE_DEPTH", 8))
+
+
+def report_progress(progress, message):
+    if progress:
+        progress(message)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class WorkspaceBusy(Exception):
+    pass
+
+
+class Job:
+    # 작업 진행 상황을 큐로 전달하고, 끝나면 결과(또는 예외)를 보관한다
+    def __init__(self):
+        self.updates = queue.Queue()
+        self.result = None
+        self.error = None
+
+    def report(self, message):
+        self.updates.put(message)
+
+    def stream(self):
+        # 진행 메시지를 하나씩 돌려주고 작업이 끝나면(None) 종료
+        while True:
+            message = self.updates.get()
+            if message is None:
+                return
+            yield message
+
+
+class JobQueue:
+    # 고정 크기 워커 풀 + 제한된 대기열. 가득 차면 JobQueueFull로 거절 (back-pressure).
+    # key(세션 작업 공간)마다 작업은 하나만: 실행 중인 작업이 있으면 WorkspaceBusy로 거절한다
+    # (같은 작업 공간의 down_code, merged, coverage를 두 작업이 동시에 지우거나 덮어쓰지 않도록)
+    def __init__(self, max_workers=None, max_pending=None):
+        max_workers = max_workers or JOB_WORKERS
+        max_pending = JOB_QUEUE_DEPTH if max_pending is None else max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="codecollector-job")
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.active_keys = set()
+        self.keys_lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None):
+        with self.keys_lock:
+            if key is not None and key in self.active_keys:
+                raise WorkspaceBusy("Another job from this session is still running. Please wait for it to finish.")
+            if not self.slots.acquire(blocking=False):
+                raise JobQueueFull("Too many jobs are running. Please try again shortly.")
+            if key is not None:
+                self.active_keys.add(key)
+        job = Job()
+        job.report("Queued...")
+        self.executor.submit(self.run, job, fn, args, key)
+        return job
+
+    def run(self, job, fn, args, key=None):
+        try:
+            job.result = fn(*args, progress=job.report)
+        except Exception as e:
+            job.error = e
+        finally:
+            with self.keys_lock:
+                self.active_keys.discard(key)
+            self.slots.release()
+            job.updates.put(None)
+
+
+def cleanup_stale_workspaces(max_age=None):
+    # 오랫동안 사용하지 않은 작업 공간 삭제
+    if max_age is None:
+        max_age = WORKSPACE_MAX_AGE
+    if not os.path.isdir(WORKSPACE_ROOT):
+        return []
+    deadline = time.time() - max_age
+    removed = []
+    for entry in os.scandir(WORKSPACE_ROOT):
+        if entry.is_dir() and entry.name.startswith("job-") and entry.stat().st_mtime < deadline:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.path)
+    return removed
+
+
+def create_workspace():
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    cleanup_stale_workspaces()
+    return tempfile.mkdtemp(prefix="job-", dir=WORKSPACE_ROOT)
+
+
+def ensure_workspace(workspace):
+    # 세션의 작업 공간이 없거나 정리되었으면 새로 만든다
+    if not workspace or not os.path.isdir(workspace):
+        return create_workspace()
+    now = time.time()
+    os.utime(workspace, (now, now))
+    return workspace
+
+
+def remove_workspace(workspace):
+    if workspace and os.path.isdir(workspace):
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def get_workspace_dir(workspace, name):
+    # workspace가 없으면 예전처럼 현재 디렉터리 아래를 사용
+    return os.path.join(workspace or os.getcwd(), name)
+
+
+process_pool = None
+process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    # 작업 간에 공유하는 프로세스 풀. 스레드가 많은 서버 프로세스를 fork하지 않도록 forkserver 사용
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+        return process_pool
+
+
+def reset_process_pool(broken_pool):
+    # 워커가 죽어(세그폴트, OOM) 깨진 풀을 버린다. 다음 get_process_pool()이 새 풀을 만든다.
+    # 다른 스레드가 이미 새 풀로 바꿨으면 그대로 둔다
+    global process_pool
+    with process_pool_lock:
+        if process_pool is broken_pool:
+            process_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def clear_download_folder(workspace=None):
+    download_dir = get_workspace_dir(workspace, "down_code")
     if os.path.exists(download_dir):
         shutil.rmtree(download_dir)
 
 
-def extract_code_files(path, file_extensions):
+class AtomicOutputFile:
+    # 같은 디렉터리의 임시 파일에 쓰고 완료 시 rename으로 공개 (읽는 쪽은 부분 파일을 보지 않음)
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.mode = mode
+        self.temp_path = None
+        self.file = None
+
+    def __enter__(self):
+        fd, self.temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp", dir=os.path.dirname(self.path))
+        self.file = os.fdopen(fd, self.mode)
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is None:
+            os.chmod(self.temp_path, 0o644)
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
+        return False
+
+
+def get_mirror_path(repo_url):
+    normalized = repo_url.strip().rstrip('/')
+    if normalized.endswith('.git'):
+        normalized = normalized[:-4]
+    key = hashlib.sha1(normalized.lower().encode('utf-8')).hexdigest()[:16]
+    repo_name = normalized.split('/')[-1]
+    return os.path.join(MIRROR_CACHE_DIR, f"{repo_name}-{key}.git")
+
+
+def get_directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def evict_mirror_cache(max_bytes=None, keep=None):
+    # 가장 오래 사용하지 않은 미러부터 통째로 삭제 (LRU)
+    if max_bytes is None:
+        max_bytes = MIRROR_CACHE_MAX_BYTES
+    if not os.path.isdir(MIRROR_CACHE_DIR):
+        return []
+    mirrors = []
+    for entry in os.scandir(MIRROR_CACHE_DIR):
+        if entry.is_dir() and entry.name.endswith('.git'):
+            mirrors.append((entry.stat().st_mtime, entry.path, get_directory_size(entry.path)))
+    total = sum(size for _, _, size in mirrors)
+    evicted = []
+    for _, mirror_path, size in sorted(mirrors):
+        if total <= max_bytes:
+            break
+        if mirror_path == keep:
+            continue
+        # 다른 작업이 읽거나 갱신 중인 미러는 건너뜀
+        with open(mirror_path + ".lock", 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(mirror_path, ignore_errors=True)
+        total -= size
+        evicted.append(mirror_path)
+    return evicted
+
+
+def run_git(command, progress=None):
+    # git 명령 실행. progress가 주어지면 "Receiving objects: 45%" 같은 진행 줄을 전달
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = bytearray()
+    last_line = None
+    while True:
+        chunk = process.stdout.read1(65536)
+        if not chunk:
+            break
+        output += chunk
+        if progress:
+            lines = [line for line in re.split(rb'[\r\n]', bytes(output[-4096:])) if b'%' in line]
+            if lines and lines[-1] != last_line:
+                last_line = lines[-1]
+                progress(last_line.decode('utf-8', errors='replace').strip())
+    process.wait()
+    if process.returncode != 0:
+        return output.decode('utf-8', errors='replace')
+    return None
+
+
+def update_mirror(repo_url, progress=None):
+    # 캐시에 bare 미러가 있으면 증분 fetch, 없으면 새로 clone
+    os.makedirs(MIRROR_CACHE_DIR, exist_ok=True)
+    mirror_path = get_mirror_path(repo_url)
+    with open(mirror_path + ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        progress_flag = "--progress" if progress else "--quiet"
+        if os.path.isdir(mirror_path):
+            report_progress(progress, "Fetching updates into cached mirror...")
+            commands = [["git", "--git-dir", mirror_path, "fetch", "--prune", "--tags", progress_flag, "origin"]]
+        else:
+            report_progress(progress, "Cloning repository into mirror cache...")
+            staging_path = f"{mirror_path}.tmp-{os.getpid()}"
+            shutil.rmtree(staging_path, ignore_errors=True)
+            commands = [
+                ["git", "clone", "--bare", progress_flag, repo_url, staging_path],
+                ["git", "--git-dir", staging_path, "config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"],
+            ]
+        for command in commands:
+            errors = run_git(command, progress)
+            if errors:
+                if not os.path.isdir(mirror_path):
+                    shutil.rmtree(staging_path, ignore_errors=True)
+                return None, errors
+        if not os.path.isdir(mirror_path):
+            os.rename(staging_path, mirror_path)
+        # LRU 정렬을 위해 마지막 사용 시각 갱신
+        now = time.time()
+        os.utime(mirror_path, (now, now))
+    evict_mirror_cache(keep=mirror_path)
+    return mirror_path, None
+
+
+def clone_repository(repo_url, dest_dir, file_extensions, clone_strategy="mirror", progress=None):
+    # 선택한 전략으로 dest_dir에 작업 트리를 만든다. 실패 시 에러 메시지 반환
+    progress_flag = "--progress" if progress else "--quiet"
+    if clone_strategy == "mirror":
+        mirror_path, errors = update_mirror(repo_url, progress)
+        if mirror_path is None:
+            return errors
+        # 캐시된 미러에서 로컬로 체크아웃 (객체는 공유하므로 네트워크/복사 없음)
+        return run_git(["git", "clone", "--shared", progress_flag, mirror_path, dest_dir], progress)
+    report_progress(progress, f"Cloning repository ({clone_strategy})...")
+    if clone_strategy == "shallow":
+        return run_git(["git", "clone", "--depth", "1", "--single-branch", "--no-tags", progress_flag, repo_url, dest_dir], progress)
+    if clone_strategy == "blobless":
+        return run_git(["git", "clone", "--filter=blob:none", "--single-branch", "--no-tags", progress_flag, repo_url, dest_dir], progress)
+    if clone_strategy == "sparse":
+        errors = run_git(["git", "clone", "--filter=blob:none", "--depth", "1", "--single-branch", "--no-tags", "--no-checkout", progress_flag, repo_url, dest_dir], progress)
+        if errors:
+            return errors
+        # 요청한 확장자에 해당하는 blob만 checkout 시 내려받는다
+        patterns = [f"*{ext}" for ext in file_extensions]
+        errors = run_git(["git", "-C", dest_dir, "sparse-checkout", "set", "--no-cone"] + patterns)
+        if errors:
+            return errors
+        return run_git(["git", "-C", dest_dir, "checkout", progress_flag], progress)
+    return f"Unknown clone strategy: {clone_strategy}"
+
+
+def compile_gitignore_pattern(pattern):
+    # .gitignore 패턴 한 줄을 (정규식, 부정 여부, 디렉터리 전용, 경로 고정 여부)로 변환
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == '*':
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == '?':
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            char_class = pattern[i + 1:end]
+            if char_class.startswith('!'):
+                char_class = '^' + char_class[1:]
+            regex += "[" + char_class + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + "$"), negate, dir_only, anchored
+
+
+def load_gitignore(directory, rel_dir):
+    try:
+        with open(os.path.join(directory, ".gitignore"), 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        regex, negate, dir_only, anchored = compile_gitignore_pattern(line)
+        rules.append((rel_dir, regex, negate, dir_only, anchored))
+    return rules
+
+
+def is_gitignored(rules, rel_path, name, is_dir):
+    # 마지막으로 일치한 규칙이 결과를 결정한다
+    ignored = False
+    for base, regex, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if anchored:
+            if base and not rel_path.startswith(base + '/'):
+                continue
+            target = rel_path[len(base) + 1:] if base else rel_path
+        else:
+            target = name
+        if regex.match(target):
+            ignored = not negate
+    return ignored
+
+
+def make_extension_matcher(file_extensions):
+    # 확장자 비교를 미리 계산한 집합 조회로 대체 (".d.ts" 같은 다중 확장자는 endswith)
+    suffixes = frozenset(ext for ext in file_extensions if ext.count('.') == 1 and ext.startswith('.'))
+    other_suffixes = tuple(ext for ext in file_extensions if ext not in suffixes)
+
+    def matches(name):
+        dot = name.rfind('.')
+        if dot != -1 and name[dot:] in suffixes:
+            return True
+        return bool(other_suffixes) and name.endswith(other_suffixes)
+
+    return matches
+
+
+def is_pruned_path(rel_path, prune_dirs=None):
+    if prune_dirs is None:
+        prune_dirs = PRUNE_DIRS
+    return any(part in prune_dirs for part in rel_path.split('/')[:-1])
+
+
+def scan_code_files(root, file_extensions, prune_dirs=None, use_gitignore=True, workers=None):
+    # os.scandir 기반 탐색: 제외 디렉터리와 .gitignore 대상은 내려가지 않고, 하위 트리는 스레드로 병렬 탐색
+    if prune_dirs is None:
+        prune_dirs = PRUNE_DIRS
+    if workers is None:
+        workers = SCAN_WORKERS
+    matches = make_extension_matcher(file_extensions)
+
+    def scan_directory(rel_dir, rules):
+        directory = os.path.join(root, rel_dir) if rel_dir else root
+        if use_gitignore:
+            rules = rules + load_gitignore(directory, rel_dir)
+        files = []
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in prune_dirs or (rules and is_gitignored(rules, rel_path, entry.name, True)):
+                        continue
+                    subdirs.append((rel_path, rules))
+                elif matches(entry.name) and entry.is_file():
+                    if rules and is_gitignored(rules, rel_path, entry.name, False):
+                        continue
+                    files.append(rel_path)
+        return files, subdirs
+
+    found = []
+    if workers <= 1:
+        pending = [("", [])]
+        while pending:
+            files, subdirs = scan_directory(*pending.pop())
+            found.extend(files)
+            pending.extend(subdirs)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(scan_directory, "", [])}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    found.extend(files)
+                    pending.update(executor.submit(scan_directory, *subdir) for subdir in subdirs)
+    found.sort()
+    return found
+
+
+def list_git_tree(git_dir, revision="HEAD"):
+    # 체크아웃 없이 커밋의 파일 목록(경로, blob id, 크기)을 가져온다
+    process = subprocess.Popen(["git", "--git-dir", git_dir, "ls-tree", "-r", "-l", "-z", revision], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(errors.decode('utf-8', errors='replace'))
+    entries = []
+    for record in output.split(b'\0'):
+        if not record:
+            continue
+        info, rel_path = record.split(b'\t', 1)
+        mode, object_type, object_id, size = info.split()
+        # 서브모듈과 심볼릭 링크는 건너뜀
+        if object_type != b'blob' or mode == b'120000':
+            continue
+        entries.append((rel_path.decode('utf-8', errors='surrogateescape'), object_id.decode('ascii'), int(size)))
+    return entries
+
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def copy_fd_range(in_fd, out_fd, count):
+    # 커널 안에서 복사: sendfile → copy_file_range → 고정 크기 버퍼 복사 순으로 시도
+    # (모두 fd의 현재 오프셋을 사용하므로 중간에 다음 방법으로 넘어가도 이어서 복사된다)
+    remaining = count
+    for kernel_copy in (getattr(os, "sendfile", None), getattr(os, "copy_file_range", None)):
+        if kernel_copy is None:
+            continue
+        try:
+            while remaining > 0:
+                if kernel_copy is os.sendfile:
+                    copied = os.sendfile(out_fd, in_fd, None, min(remaining, 1 << 30))
+                else:
+                    copied = os.copy_file_range(in_fd, out_fd, min(remaining, 1 << 30))
+                if copied == 0:
+                    return count - remaining
+                remaining -= copied
+            return count
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+    while remaining > 0:
+        chunk = os.read(in_fd, min(remaining, COPY_BUFFER_SIZE))
+        if not chunk:
+            break
+        os.write(out_fd, chunk)
+        remaining -= len(chunk)
+    return count - remaining
+
+
+class GitObjectReader:
+    # 하나의 `git cat-file --batch` 프로세스로 blob을 연속해서 읽는다
+    def __init__(self, git_dir):
+        self.process = subprocess.Popen(["git", "--git-dir", git_dir, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lock = threading.Lock()
+
+    def read(self, object_id):
+        with self.lock:
+            self.process.stdin.write(object_id.encode('ascii') + b'\n')
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().split()
+            if len(header) != 3:
+                raise KeyError(f"Object not found: {object_id}")
+            content = self.process.stdout.read(int(header[2]))
+            self.process.stdout.read(1)
+            return content
+
+    def copy_into(self, object_id, out_file):
+        # blob을 메모리에 올리지 않고 고정 크기 조각으로 out_file에 쓴다
+        with self.lock:
+            self.process.stdin.write(object_id.encode('ascii') + b'\n')
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().split()
+            if len(header) != 3:
+                raise KeyError(f"Object not found: {object_id}")
+            remaining = int(header[2])
+            while remaining > 0:
+                chunk = self.process.stdout.read(min(remaining, COPY_BUFFER_SIZE))
+                out_file.write(chunk)
+                remaining -= len(chunk)
+            self.process.stdout.read(1)
+            return int(header[2])
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class DirectorySource:
+    # 디렉터리(down_code 또는 로컬 폴더)에서 파일을 읽는다
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, rel_path):
+        with open(os.path.join(self.root, rel_path), 'rb') as f:
+            return f.read()
+
+    def size(self, rel_path):
+        return os.path.getsize(os.path.join(self.root, rel_path))
+
+    def read_ends(self, rel_path, limit):
+        # 앞뒤 limit 바이트와 파일 크기. 작은 파일은 한 번 읽은 내용을 앞뒤로 같이 쓴다
+        with open(os.path.join(self.root, rel_path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(limit)
+            if size <= limit:
+                return head, head, size
+            f.seek(size - limit)
+            return head, f.read(limit), size
+
+    def copy_into(self, rel_path, out_file):
+        with open(os.path.join(self.root, rel_path), 'rb') as f:
+            out_file.flush()
+            return copy_fd_range(f.fileno(), out_file.fileno(), os.fstat(f.fileno()).st_size)
+
+    def close(self):
+        pass
+
+
+class GitObjectSource:
+    # 미러의 git 객체 데이터베이스에서 파일을 직접 읽는다 (작업 트리/복사 없음)
+    def __init__(self, git_dir, object_ids, sizes=None):
+        self.git_dir = git_dir
+        self.object_ids = object_ids
+        self.sizes = sizes or {}
+        # 읽는 동안 미러가 캐시에서 삭제되지 않도록 공유 잠금
+        self.lock_file = open(git_dir + ".lock", 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+        # 스레드마다 cat-file 프로세스를 하나씩 사용
+        self.local = threading.local()
+        self.readers = []
+        self.readers_lock = threading.Lock()
+
+    @property
+    def reader(self):
+        reader = getattr(self.local, "reader", None)
+        if reader is None:
+            reader = GitObjectReader(self.git_dir)
+            self.local.reader = reader
+            with self.readers_lock:
+                self.readers.append(reader)
+        return reader
+
+    def read(self, rel_path):
+        return self.reader.read(self.object_ids[rel_path])
+
+    def size(self, rel_path):
+        return self.sizes.get(rel_path)
+
+    def read_ends(self, rel_path, limit):
+        # cat-file은 일부만 읽을 수 없으므로 전체를 읽어 자른다
+        content = self.read(rel_path)
+        return content[:limit], content[-limit:], len(content)
+
+    def copy_into(self, rel_path, out_file):
+        return self.reader.copy_into(self.object_ids[rel_path], out_file)
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+        self.lock_file.close()
+
+
+MANIFEST_VERSION = 1
+
+
+def copy_and_hash(src_path, dest_path):
+    # 파일을 복사하면서 git blob id(sha1)를 계산한다
+    size = os.path.getsize(src_path)
+    digest = hashlib.sha1(f"blob {size}\0".encode('ascii'))
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        while True:
+            chunk = src.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dest.write(chunk)
+    return size, digest.hexdigest()
+
+
+def get_manifest_path(workspace=None):
+    return get_workspace_dir(workspace, "extraction_manifest.json")
+
+
+def save_manifest(manifest, workspace=None):
+    with AtomicOutputFile(get_manifest_path(workspace)) as f:
+        json.dump(manifest, f)
+
+
+def load_manifest(workspace=None):
+    try:
+        with open(get_manifest_path(workspace), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def resolve_remote_commit(repo_url):
+    process = subprocess.Popen(["git", "ls-remote", repo_url, "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output, _ = process.communicate()
+    if process.returncode != 0 or not output:
+        return None
+    return output.split()[0].decode('ascii')
+
+
+def list_local_files(path, file_extensions):
+    local_files = {}
+    for rel_path in scan_code_files(path, file_extensions):
+        stat = os.stat(os.path.join(path, rel_path))
+        local_files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return local_files
+
+
+def is_manifest_valid(manifest, path, file_extensions, clone_strategy):
+    # 같은 입력이고 원본이 바뀌지 않았으면 이전 추출 결과를 그대로 쓴다
+    if not manifest or manifest["path"] != path or manifest["extensions"] != sorted(set(file_extensions)):
+        return False
+    if manifest["backend"] == "git":
+        if not os.path.isdir(manifest["git_dir"]):
+            return False
+    elif not os.path.isdir(manifest["root"]):
+        return False
+    if path.startswith('https://github.com'):
+        if manifest["clone_strategy"] != clone_strategy:
+            return False
+        return resolve_remote_commit(path) == manifest["commit"]
+    local_files = list_local_files(path, file_extensions)
+    return local_files == {entry["path"]: (entry["size"], entry["mtime_ns"]) for entry in manifest["files"]}
+
+
+def open_manifest_source(manifest):
+    if manifest["backend"] == "git":
+        return GitObjectSource(manifest["git_dir"], {entry["path"]: entry["hash"] for entry in manifest["files"]}, {entry["path"]: entry["size"] for entry in manifest["files"]})
+    return DirectorySource(manifest["root"])
+
+
+def get_or_extract_code_files(path, file_extensions, clone_strategy="mirror", manifest=None, workspace=None, progress=None):
+    # 세션의 manifest가 유효하면 재사용하고, 아니면 새로 추출한다
+    if manifest is None:
+        manifest = load_manifest(workspace)
+    report_progress(progress, "Checking previous extraction...")
+    if is_manifest_valid(manifest, path, file_extensions, clone_strategy):
+        return "Reusing previous extraction.", manifest
+    return extract_code_files(path, file_extensions, clone_strategy, workspace, progress)
+
+
+def extract_code_files(path, file_extensions, clone_strategy="mirror", workspace=None, progress=None):
     # 파일 확장자 유효성 검사 (선택적)
     valid_extensions = ['.py', '.js', '.java', '.c', '.cpp', '.h', '.kt', '.html', '.css', '.md', '.go', '.rs', '.ts', '.tsx', '.rb', '.php', '.cs', '.swift', '.ipynb', '.csproj']
     invalid_extensions = [ext for ext in file_extensions if ext not in valid_extensions]
     if invalid_extensions:
-        return f"Error: Invalid file extensions: {', '.join(invalid_extensions)}", []
+        return f"Error: Invalid file extensions: {', '.join(invalid_extensions)}", None
     
-    download_dir = os.path.join(os.getcwd(), "down_code")
-    if os.path.exists(download_dir):
-        shutil.rmtree(download_dir)
-    os.makedirs(download_dir, exist_ok=True)
+    download_dir = get_workspace_dir(workspace, "down_code")
+    clear_download_folder(workspace)
     
-    downloaded_files = []
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "path": path,
+        "extensions": sorted(set(file_extensions)),
+        "clone_strategy": clone_strategy,
+        "commit": None,
+        "backend": "directory",
+        "root": download_dir,
+        "files": [],
+    }
     
+    if path.startswith('https://github.com') and clone_strategy == "mirror":
+        # 미러의 객체 데이터베이스에서 바로 읽음 (checkout, down_code 복사 없음)
+        try:
+            mirror_path, errors = update_mirror(path, progress)
+            if mirror_path is None:
+                return f"Error cloning repository: {errors}", None
+            manifest["backend"] = "git"
+            manifest["git_dir"] = mirror_path
+            manifest["commit"] = subprocess.check_output(["git", "--git-dir", mirror_path, "rev-parse", "HEAD"]).decode('ascii').strip()
+            matches = make_extension_matcher(file_extensions)
+            for rel_path, object_id, size in list_git_tree(mirror_path, manifest["commit"]):
+                if matches(rel_path.rsplit('/', 1)[-1]) and not is_pruned_path(rel_path, VCS_DIRS):
+                    manifest["files"].append({"path": rel_path, "size": size, "hash": object_id})
+            report_progress(progress, f"Found {len(manifest['files'])} matching files.")
+        except Exception as e:
+            return f"Error: {str(e)}", None
+        save_manifest(manifest, workspace)
+        return "Extraction completed successfully.", manifest
+
+    os.makedirs(download_dir, exist_ok=True)
     if path.startswith('https://github.com'):
         # GitHub 저장소 처리
         with tempfile.TemporaryDirectory() as temp_dir:
             try:
-                process = subprocess.Popen(["git", "clone", path, temp_dir], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                output, errors = process.communicate()
-                if process.returncode != 0:
-                    return f"Error cloning repository: {errors.decode('utf-8')}", []
-
-                for root, _, files in os.walk(temp_dir):
-                    for file in files:
-                        if any(file.endswith(ext) for ext in file_extensions):
-                            full_path = os.path.join(root, file)
-                            rel_path = os.path.relpath(full_path, start=temp_dir)
-                            dest_path = os.path.join(download_dir, rel_path)
-                            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                            shutil.copy(full_path, dest_path)
-                            downloaded_files.append(rel_path)
+                errors = clone_repository(path, temp_dir, file_extensions, clone_strategy, progress)
+                if errors:
+                    return f"Error cloning repository: {errors}", None
+                manifest["commit"] = subprocess.check_output(["git", "-C", temp_dir, "rev-parse", "HEAD"]).decode('ascii').strip()
+
+                # clone에는 커밋된 파일만 있으므로 .gitignore와 PRUNE_DIRS를 적용하지 않는다 (mirror 방식과 같은 파일 목록)
+                for rel_path in scan_code_files(temp_dir, file_extensions, prune_dirs=VCS_DIRS, use_gitignore=False):
+                    full_path = os.path.join(temp_dir, rel_path)
+                    dest_path = os.path.join(download_dir, rel_path)
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                    size, digest = copy_and_hash(full_path, dest_path)
+                    manifest["files"].append({"path": rel_path, "size": size, "hash": digest})
+                    if len(manifest["files"]) % 100 == 0:
+                        report_progress(progress, f"Copied {len(manifest['files'])} files...")
 
             except Exception as e:
-                return f"Error: {str(e)}", []
+                return f"Error: {str(e)}", None
     else:
         # 로컬 폴더 경로 처리
         if not os.path.exists(path) or not os.path.isdir(path):
-            return "Error: Invalid local folder path.", []
+            return "Error: Invalid local folder path.", None
         
-        for root, _, files in os.walk(path):
-            for file in files:
-                if any(file.endswith(ext) for ext in file_extensions):
-                    full_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(full_path, start=path)
-                    dest_path = os.path.join(download_dir, rel_path)
-                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                    shutil.copy(full_path, dest_path)
-                    downloaded_files.append(rel_path)
+        for rel_path in scan_code_files(path, file_extensions):
+            full_path = os.path.join(path, rel_path)
+            dest_path = os.path.join(download_dir, rel_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            mtime_ns = os.stat(full_path).st_mtime_ns
+            size, digest = copy_and_hash(full_path, dest_path)
+            manifest["files"].append({"path": rel_path, "size": size, "hash": digest, "mtime_ns": mtime_ns})
+            if len(manifest["files"]) % 100 == 0:
+                report_progress(progress, f"Copied {len(manifest['files'])} files...")
 
-    return "Extraction completed successfully.", downloaded_files
+    save_manifest(manifest, workspace)
+    return "Extraction completed successfully.", manifest
 
 
 
-def download_and_extract_arxiv_pdfs(readme_content):
-    arxiv_links = re.findall(r'https://arxiv.org/(?:abs|pdf)/\S+', readme_content)
-    pdf_texts = []
-    for link in arxiv_links:
-        if 'arxiv.org/abs/' in link:
-            pdf_url = link.replace('arxiv.org/abs/', 'arxiv.org/pdf/') + '.pdf'
-        else:
-            pdf_url = link
+def parse_arxiv_links(readme_content):
+    # abs/pdf 링크를 (논문 ID, 버전)으로 정규화하고 중복 제거 (등장 순서 유지)
+    papers = []
+    for paper_id, version in ARXIV_LINK_PATTERN.findall(readme_content):
+        paper = (paper_id.lower(), version.lower())
+        if paper not in papers:
+            papers.append(paper)
+    return papers
+
+
+def get_arxiv_pdf_url(paper_id, version=""):
+    return f"https://arxiv.org/pdf/{paper_id}{version}.pdf"
+
+
+def get_arxiv_cache_path(paper_id, version="", variant=""):
+    # variant: 페이지/섹션 제한 옵션별로 결과가 다르므로 캐시 키에 포함
+    return os.path.join(ARXIV_CACHE_DIR, f"{paper_id.replace('/', '_')}{version or '-latest'}{variant}.txt.z")
+
+
+def load_cached_arxiv_text(paper_id, version="", variant=""):
+    cache_path = get_arxiv_cache_path(paper_id, version, variant)
+    try:
+        with open(cache_path, 'rb') as f:
+            text = zlib.decompress(f.read()).decode('utf-8')
+    except (OSError, zlib.error):
+        return None
+    # LRU 정렬을 위해 마지막 사용 시각 갱신. 읽은 뒤 다른 작업이 캐시에서 지웠을 수 있다
+    now = time.time()
+    try:
+        os.utime(cache_path, (now, now))
+    except OSError:
+        pass
+    return text
+
+
+def store_arxiv_text(paper_id, version, text, variant=""):
+    os.makedirs(ARXIV_CACHE_DIR, exist_ok=True)
+    with AtomicOutputFile(get_arxiv_cache_path(paper_id, version, variant), 'wb') as f:
+        f.write(zlib.compress(text.encode('utf-8'), 6))
+    evict_file_cache(ARXIV_CACHE_DIR, ARXIV_CACHE_MAX_BYTES)
+
+
+def evict_file_cache(cache_dir, max_bytes):
+    # 가장 오래 사용하지 않은 파일부터 삭제 (LRU)
+    cached = []
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        # 다른 프로세스가 동시에 삭제했을 수 있다
         try:
-            pdf_filename = wget.download(pdf_url)
-            try:
-                text = extract_text_from_pdf(pdf_filename)
-                pdf_texts.append(text)
-            except Exception as e:
-                print(f"Error extracting text from {pdf_filename}: {e}")
-            os.remove(pdf_filename)
-        except urllib.error.HTTPError as e:
-            if e.code == 404:
-                print(f"PDF not found for arXiv link: {link}")
-            else:
-                raise
-    return "\n\n".join(pdf_texts)
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        cached.append((stat.st_mtime, entry.path, stat.st_size))
+    total = sum(size for _, _, size in cached)
+    evicted = []
+    for _, path, size in sorted(cached):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted.append(path)
+    return evicted
+
+
+async def fetch_pdf(client, host_limits, url, retries=ARXIV_RETRIES, backoff=ARXIV_BACKOFF):
+    # PDF를 메모리로 받는다. 연결 오류, 429, 5xx는 지수 백오프로 재시도
+    host = urllib.parse.urlsplit(url).netloc
+    semaphore = host_limits.setdefault(host, asyncio.Semaphore(ARXIV_MAX_CONNECTIONS_PER_HOST))
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                response = await client.get(url, follow_redirects=True)
+            if response.status_code == 404:
+                print(f"PDF not found for arXiv link: {url}")
+                return None
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                # 재시도해도 결과가 같은 4xx는 건너뛴다
+                print(f"Error downloading {url}: HTTP {response.status_code}")
+                return None
+            if response.status_code < 400:
+                return response.content
+            error = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            error = str(e) or type(e).__name__
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+    print(f"Error downloading {url}: {error}")
+    return None
+
+
+async def fetch_pdfs(urls, progress=None):
+    # 하나의 커넥션 풀을 공유하는 비동기 클라이언트로 동시에 다운로드
+    host_limits = {}
+    fetched = 0
+    limits = httpx.Limits(max_connections=ARXIV_MAX_CONNECTIONS_PER_HOST * 4, max_keepalive_connections=ARXIV_MAX_CONNECTIONS_PER_HOST)
+
+    async def fetch(client, url):
+        nonlocal fetched
+        content = await fetch_pdf(client, host_limits, url)
+        fetched += 1
+        report_progress(progress, f"Fetched arXiv PDF {fetched}/{len(urls)}: {url}")
+        return content
+
+    async with httpx.AsyncClient(timeout=ARXIV_TIMEOUT, limits=limits) as client:
+        return await asyncio.gather(*(fetch(client, url) for url in urls))
+
+
+def get_pdf_budget_variant(max_pages=None, sections=None, drop_references=False):
+    if not max_pages and not sections and not drop_references:
+        return ""
+    key = json.dumps([max_pages or 0, sorted(sections or []), bool(drop_references)])
+    return "-" + hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+
+
+def download_and_extract_arxiv_pdfs(readme_content, progress=None, max_pages=None, sections=None, drop_references=False):
+    papers = parse_arxiv_links(readme_content)
+    if not papers:
+        return ""
+    variant = get_pdf_budget_variant(max_pages, sections, drop_references)
+    # 캐시에 있는 논문은 다운로드/추출 없이 사용
+    texts = {paper: load_cached_arxiv_text(*paper, variant) for paper in papers}
+    missing = [paper for paper in papers if texts[paper] is None]
+    report_progress(progress, f"Found {len(papers)} arXiv papers ({len(papers) - len(missing)} cached).")
+    if missing:
+        pdf_urls = [get_arxiv_pdf_url(*paper) for paper in missing]
+        pdf_contents = asyncio.run(fetch_pdfs(pdf_urls, progress))
+        downloaded = [(paper, pdf_content) for paper, pdf_content in zip(missing, pdf_contents) if pdf_content is not None]
+        report_progress(progress, f"Extracting text from {len(downloaded)} PDFs...")
+        extracted = extract_texts_from_pdfs([pdf_content for _, pdf_content in downloaded], max_pages=max_pages, sections=sections, drop_references=drop_references)
+        for (paper, _), text in zip(downloaded, extracted):
+            if text is None:
+                continue
+            texts[paper] = text
+            store_arxiv_text(*paper, text, variant)
+    return "\n\n".join(texts[paper] for paper in papers if texts[paper] is not None)
 
     
 
-def extract_text_from_pdf(pdf_path):
-    text = extract_text(pdf_path)
-    return text
+def extract_pages_pymupdf(pdf_bytes, start, stop):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        stop = document.page_count if stop is None else min(stop, document.page_count)
+        return "".join(document[page].get_text() for page in range(start, stop))
+
+
+def extract_pages_pdfminer(pdf_bytes, start, stop):
+    page_numbers = None if stop is None else range(start, stop)
+    return extract_text(io.BytesIO(pdf_bytes), page_numbers=page_numbers)
+
+
+PDF_ENGINES = {
+    "pymupdf": extract_pages_pymupdf,
+    "pdfminer": extract_pages_pdfminer,
+}
+
+
+def extract_pdf_pages(pdf_bytes, start, stop, engine=None):
+    # 선택한 엔진으로 [start, stop) 페이지를 추출하고, 실패하면 pdfminer로 다시 시도
+    engine = engine or PDF_ENGINE
+    try:
+        return PDF_ENGINES[engine](pdf_bytes, start, stop)
+    except Exception:
+        if engine == "pdfminer":
+            raise
+        return extract_pages_pdfminer(pdf_bytes, start, stop)
+
+
+def count_pdf_pages(pdf_bytes):
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+            return document.page_count
+    except Exception:
+        return None
+
+
+class PdfSectionFilter:
+    # 페이지 텍스트를 순서대로 받아 제목 줄로 섹션을 구분하고, 선택한 섹션만 남긴다.
+    # drop_references이면 References/Appendix 제목을 만나는 순간 done이 되어 이후 페이지는 처리하지 않는다
+    def __init__(self, sections=None, drop_references=False):
+        self.sections = set(sections) if sections else None
+        self.drop_references = drop_references
+        self.section = "title"
+        self.done = False
+
+    def feed(self, text):
+        kept = []
+        for line in text.splitlines(keepends=True):
+            match = PDF_HEADING_PATTERN.match(line) if len(line) < 80 else None
+            if match:
+                self.section = PDF_SECTION_NAMES[match.group(1).lower()]
+                if self.drop_references and self.section in ("references", "appendix"):
+                    self.done = True
+                    break
+            if self.sections is None or self.section in self.sections:
+                kept.append(line)
+        return "".join(kept)
+
+
+def extract_texts_from_pdfs(pdf_contents, engine=None, pages_per_task=PDF_PAGES_PER_TASK, pool=None, max_pages=None, sections=None, drop_references=False):
+    # 공유 풀이 깨지면 새 풀로 한 번 더 시도한다. 또 깨지면(같은 PDF가 워커를 죽이는 경우) 풀만 새로 두고 이 PDF들은 건너뛴다
+    for attempt in range(2):
+        shared_pool = pool or get_process_pool()
+        try:
+            return extract_texts_with_pool(pdf_contents, engine, pages_per_task, shared_pool, max_pages, sections, drop_references)
+        except BrokenProcessPool as e:
+            if pool is not None:
+                raise
+            reset_process_pool(shared_pool)
+            print(f"PDF extraction worker died ({e}), {'retrying' if attempt == 0 else 'skipping these PDFs'}")
+    return [None] * len(pdf_contents)
+
+
+def extract_texts_with_pool(pdf_contents, engine, pages_per_task, pool, max_pages, sections, drop_references):
+    # PDF들(큰 PDF는 페이지 구간 단위로 나눠서)을 프로세스 풀에 분배하고, PDF별로 페이지 순서대로 흘려보내며 합친다.
+    # max_pages 이후 페이지는 추출하지 않고, References/Appendix에 도달하면 남은 구간은 취소한다
+    ranges = []
+    for pdf_bytes in pdf_contents:
+        page_count = count_pdf_pages(pdf_bytes)
+        if page_count is None:
+            # 페이지 수를 모르면 문서 전체(또는 max_pages까지)를 한 번에 처리
+            ranges.append([(0, max_pages or None)])
+            continue
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        ranges.append([(start, min(start + pages_per_task, page_count)) for start in range(0, max(page_count, 1), pages_per_task)])
+    futures = None
+    if sum(map(len, ranges)) > 1:
+        futures = [[pool.submit(extract_pdf_pages, pdf_bytes, start, stop, engine) for start, stop in pdf_ranges] for pdf_bytes, pdf_ranges in zip(pdf_contents, ranges)]
+    texts = []
+    for index, pdf_bytes in enumerate(pdf_contents):
+        section_filter = PdfSectionFilter(sections, drop_references)
+        chunks = []
+        try:
+            for position, (start, stop) in enumerate(ranges[index]):
+                if section_filter.done:
+                    for future in futures[index][position:] if futures else []:
+                        future.cancel()
+                    break
+                if futures:
+                    page_text = futures[index][position].result()
+                else:
+                    page_text = extract_pdf_pages(pdf_bytes, start, stop, engine)
+                chunks.append(section_filter.feed(page_text))
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            print(f"Error extracting text from PDF {index + 1}: {e}")
+            texts.append(None)
+            continue
+        texts.append("".join(chunks))
+    return texts
+
+
+SECTION_FOOTER = b"\n```\n\n"
+
+
+def section_header(file_path, language, note=None):
+    # 모든 "## File:" 섹션이 같이 쓰는 머리말. note는 skeleton/노트북 등 렌더링 방식 설명 한 줄
+    note_line = f"### {note}\n" if note else ""
+    return (
+        f"## File: {file_path}\n"
+        f"### Language: {language}\n"
+        f"### Description:\n"
+        f"This file contains the implementation of...\n\n"
+        f"{note_line}"
+        f"### Code:\n"
+        f"```{language}\n"
+    ).encode('utf-8')
+
+
+def full_section_summary(file_path, content):
+    # 원문 그대로 렌더링한 섹션의 요약 (정규화/공통 블록 제거가 요약을 처음 만들 때)
+    return {"mode": "full", "original": len(content), "rendered": len(content), "language": get_language_by_extension(file_path)}
+
+
+def render_file_section(source, file_path):
+    # 파일 하나의 "## File:" 섹션을 [머리말, 내용, 꼬리] bytes 조각으로 만든다.
+    # 큰 파일은 내용 대신 경로(str)를 넣어 두고, 쓰는 쪽에서 source.copy_into로 이어 붙인다
+    header = section_header(file_path, get_language_by_extension(file_path))
+    size = source.size(file_path)
+    if size is None or size > MERGE_INLINE_MAX_BYTES:
+        return [header, file_path, SECTION_FOOTER]
+    return [header, source.read(file_path), SECTION_FOOTER]
+
+
+def get_brace_token_pattern(quotes):
+    # 주석, 문자열/문자 리터럴은 통째로 건너뛰고 { } ; 만 구조로 본다
+    strings = []
+    if '"' in quotes:
+        strings.append(r'"(?:\\.|[^"\\\n])*"')
+    if "'" in quotes:
+        strings.append(r"'(?:\\.|[^'\\\n])*'")
+    else:
+        strings.append(r"'(?:\\[^'\n]{1,8}|[^\\'\n])'")
+    if '`' in quotes:
+        strings.append(r'`(?:\\.|[^`\\])*`')
+    # 앞에 백슬래시가 있는 //, /* 는 JS 정규식 리터럴(/\/\//)의 일부
+    return re.compile(r'(?<!\\)//[^\n]*|(?<!\\)/\*.*?\*/|' + '|'.join(strings) + r'|[{};]', re.DOTALL)
 
-def combine_code_files_to_markdown(repo_url, downloaded_files):
-    repo_name = repo_url.split('/')[-1]
-    merged_dir = os.path.join(os.getcwd(), "merged")
+
+def is_brace_container(header):
+    # 블록 앞의 선언부로 클래스류인지 판단. C의 "struct foo *make(...)"처럼 괄호가 있으면 함수로 본다.
+    # 세미콜론이 없는 언어(Go, Kotlin 등)는 앞 문장까지 딸려 오므로, 빈 줄(주석 줄 포함) 뒤의 마지막 몇 줄만 뒤에서부터 맞춰 본다
+    header = re.sub(r'//[^\n]*|/\*.*?\*/', '', header, flags=re.DOTALL)
+    lines = [line for line in header.rstrip().split('\n') if not line.lstrip().startswith('#')]
+    if "" in (line.strip() for line in lines):
+        lines = lines[len(lines) - [line.strip() for line in lines][::-1].index(""):]
+    if not lines:
+        return False
+    if lines[-1].rstrip().endswith('='):
+        return True
+    for count in range(1, min(len(lines), 6) + 1):
+        candidate = "\n".join(lines[-count:]).strip()
+        match = BRACE_CONTAINER_PATTERN.match(candidate)
+        if match:
+            return not (match.group(1) in ("struct", "union", "enum") and '(' in candidate)
+    return False
+
+
+def outline_brace_source(source_code, quotes='"'):
+    # 중괄호 언어의 가벼운 skeleton: 클래스류 블록 안은 그대로 두고 함수 등의 본문은 "{ ... }"로 줄인다. 괄호가 맞지 않으면 None
+    token_pattern = get_brace_token_pattern(quotes)
+    output = []
+    containers = 0
+    hidden = 0
+    position = 0
+    head_start = 0
+    for match in token_pattern.finditer(source_code):
+        token = match.group()
+        if hidden:
+            if token == '{':
+                hidden += 1
+            elif token == '}':
+                hidden -= 1
+                if not hidden:
+                    position = head_start = match.end()
+        elif token == ';':
+            head_start = match.end()
+        elif token == '}':
+            if not containers:
+                return None
+            containers -= 1
+            head_start = match.end()
+        elif token == '{':
+            if is_brace_container(source_code[head_start:match.start()]):
+                containers += 1
+                head_start = match.end()
+            else:
+                output.append(source_code[position:match.end()])
+                output.append(" ... }")
+                hidden = 1
+    if hidden or containers:
+        return None
+    output.append(source_code[position:])
+    return "".join(output)
+
+
+def outline_source(file_path, source_code):
+    # skeleton을 만들 수 없는 언어나 파싱 실패는 None (원문 그대로 쓴다)
+    _, ext = os.path.splitext(file_path)
+    if ext == '.py':
+        return outline_python_source(source_code)
+    if ext in BRACE_LANGUAGE_QUOTES:
+        return outline_brace_source(source_code, BRACE_LANGUAGE_QUOTES[ext])
+    return None
+
+
+def has_skeleton(file_path):
+    _, ext = os.path.splitext(file_path)
+    return ext == '.py' or ext in BRACE_LANGUAGE_QUOTES
+
+
+def render_skeleton_section(source, file_path):
+    # skeleton 모드의 섹션과 요약(원래 크기, skeleton 크기). skeleton을 만들 수 없으면 전체 섹션과 None
+    if not has_skeleton(file_path):
+        return render_file_section(source, file_path), None
+    content = source.read(file_path)
+    skeleton = outline_source(file_path, content.decode('utf-8', errors='replace'))
+    if skeleton is None:
+        return render_file_section(source, file_path), None
+    skeleton = skeleton.encode('utf-8')
+    reduction = (1 - len(skeleton) / len(content)) * 100 if content else 0.0
+    language = get_language_by_extension(file_path)
+    header = section_header(file_path, language, f"Skeleton: bodies elided, {len(content)} -> {len(skeleton)} bytes ({reduction:.1f}% smaller)")
+    return [header, skeleton, SECTION_FOOTER], {"mode": "skeleton", "original": len(content), "rendered": len(skeleton), "language": language}
+
+
+class JsonScanner:
+    # JSON 바이트를 앞에서부터 한 번만 훑는다. 필요한 값만 json.loads로 디코딩하고
+    # 나머지(base64 이미지, 위젯 상태 등)는 파이썬 객체를 만들지 않고 위치만 건너뛴다
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def skip_string(self, start):
+        # 여는 따옴표 위치에서 문자열 끝 다음 위치. 앞의 백슬래시가 짝수개인 따옴표가 끝이다
+        end = self.data.find(b'"', start + 1)
+        while end >= 0:
+            escape = end - 1
+            while self.data[escape] == 0x5c:
+                escape -= 1
+            if (end - escape) % 2:
+                return end + 1
+            end = self.data.find(b'"', end + 1)
+        raise ValueError(f"Unterminated JSON string at byte {start}")
+
+    def next_token(self):
+        match = JSON_TOKEN_PATTERN.match(self.data, self.pos)
+        if match is None:
+            raise ValueError(f"Invalid JSON at byte {self.pos}")
+        start, end = match.span(1)
+        if self.data[start] == 0x22:
+            end = self.skip_string(start)
+        self.pos = end
+        return start, end
+
+    def peek(self):
+        match = JSON_TOKEN_PATTERN.match(self.data, self.pos)
+        return self.data[match.start(1):match.start(1) + 1] if match else b""
+
+    def expect(self, token):
+        start, end = self.next_token()
+        if self.data[start:end] != token:
+            raise ValueError(f"Expected {token.decode()} at byte {start}")
+
+    def skip(self):
+        # 값 하나를 건너뛰고 그 범위를 돌려준다. 컨테이너는 괄호 깊이만 센다
+        start, end = self.next_token()
+        if self.data[start] not in b"{[":
+            return start, end
+        depth = 1
+        position = end
+        while True:
+            match = JSON_NESTING_PATTERN.search(self.data, position)
+            if match is None:
+                raise ValueError(f"Unterminated JSON value at byte {start}")
+            char = self.data[match.start()]
+            position = match.end()
+            if char == 0x22:
+                position = self.skip_string(match.start())
+            elif char in b"{[":
+                depth += 1
+            else:
+                depth -= 1
+                if not depth:
+                    self.pos = position
+                    return start, position
+
+    def value(self):
+        start, end = self.skip()
+        return json.loads(self.data[start:end])
+
+    def _members(self, opener, closer, keyed):
+        self.expect(opener)
+        if self.peek() == closer:
+            self.next_token()
+            return
+        while True:
+            if keyed:
+                start, end = self.next_token()
+                key = json.loads(self.data[start:end])
+                self.expect(b":")
+                yield key
+            else:
+                yield None
+            start, end = self.next_token()
+            token = self.data[start:end]
+            if token == closer:
+                return
+            if token != b",":
+                raise ValueError(f"Expected , or {closer.decode()} at byte {start}")
+
+    def items(self):
+        # 객체의 키를 차례로 돌려준다. 호출하는 쪽은 키마다 value() 또는 skip()으로 값을 읽어야 한다
+        return self._members(b"{", b"}", True)
+
+    def elements(self):
+        # 배열의 원소마다 한 번씩 돌려준다. 원소는 호출하는 쪽이 읽는다
+        return self._members(b"[", b"]", False)
+
+
+def join_notebook_text(value):
+    # 노트북의 소스/출력 텍스트는 문자열 또는 줄 목록
+    return "".join(value) if isinstance(value, list) else (value if isinstance(value, str) else "")
+
+
+def read_notebook_output(scanner):
+    # 출력 하나의 텍스트 (stream, text/plain 결과, 오류 이름과 메시지). 이미지/HTML 등 다른 MIME 데이터는 디코딩하지 않는다
+    fields = {}
+    for key in scanner.items():
+        if key in ("text", "ename", "evalue"):
+            fields[key] = join_notebook_text(scanner.value())
+        elif key == "data":
+            for mime_type in scanner.items():
+                if mime_type == "text/plain":
+                    fields["text"] = join_notebook_text(scanner.value())
+                else:
+                    scanner.skip()
+        else:
+            scanner.skip()
+    if "ename" in fields:
+        return f"{fields['ename']}: {fields.get('evalue', '')}"
+    return fields.get("text", "")
+
+
+def read_notebook_cell(scanner, keep_outputs):
+    # (셀 종류, 소스, 텍스트 출력 목록, 출력 수). nbformat 3의 "input"도 소스로 읽는다
+    cell_type, cell_source, outputs, output_count = "code", "", [], 0
+    for key in scanner.items():
+        if key == "cell_type":
+            cell_type = scanner.value()
+        elif key in ("source", "input"):
+            cell_source = join_notebook_text(scanner.value())
+        elif key == "outputs":
+            for _ in scanner.elements():
+                output_count += 1
+                if keep_outputs:
+                    outputs.append(read_notebook_output(scanner))
+                else:
+                    scanner.skip()
+        else:
+            scanner.skip()
+    return cell_type, cell_source, [text for text in outputs if text.strip()], output_count
+
+
+def read_notebook(data, keep_outputs=False):
+    # 노트북을 한 번 훑어 (커널 언어, 셀 목록)을 돌려준다. nbformat 3은 worksheets 안에 셀이 있다
+    scanner = JsonScanner(data)
+    language = None
+    cells = []
+    for key in scanner.items():
+        if key == "cells":
+            for _ in scanner.elements():
+                cells.append(read_notebook_cell(scanner, keep_outputs))
+        elif key == "worksheets":
+            for _ in scanner.elements():
+                for worksheet_key in scanner.items():
+                    if worksheet_key == "cells":
+                        for _ in scanner.elements():
+                            cells.append(read_notebook_cell(scanner, keep_outputs))
+                    else:
+                        scanner.skip()
+        elif key == "metadata" and scanner.peek() == b"{":
+            for metadata_key in scanner.items():
+                if metadata_key in ("kernelspec", "language_info"):
+                    info = scanner.value()
+                    if isinstance(info, dict):
+                        language = language or next((value for value in (info.get("language"), info.get("name")) if isinstance(value, str) and value), None)
+                elif metadata_key == "language":
+                    value = scanner.value()
+                    if isinstance(value, str):
+                        language = language or value
+                else:
+                    scanner.skip()
+        else:
+            scanner.skip()
+    if scanner.peek():
+        raise ValueError(f"Trailing data at byte {scanner.pos}")
+    return (language or "python").lower(), cells
+
+
+def render_notebook_cells(cells, language, output_chars):
+    # "# %%" 형식: 코드 셀은 그대로, 마크다운/raw 셀과 (잘린) 텍스트 출력은 주석으로
+    prefix = NOTEBOOK_COMMENT_PREFIXES.get(language, '#')
+    comment = lambda text: "\n".join(f"{prefix} {line}".rstrip() for line in text.rstrip("\n").split("\n"))
+    blocks = []
+    for cell_type, cell_source, outputs, _ in cells:
+        if not cell_source.strip() and not outputs:
+            continue
+        if cell_type == "code":
+            block = f"{prefix} %%\n{cell_source.rstrip()}"
+        else:
+            block = f"{prefix} %% [{cell_type}]\n{comment(cell_source)}"
+        if outputs:
+            text = "\n".join(output.rstrip("\n") for output in outputs)
+            if len(text) > output_chars:
+                text = text[:output_chars] + f"\n... [{len(text) - output_chars} more characters]"
+            block += f"\n{prefix} Output:\n{comment(text)}"
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def render_notebook_section(source, file_path, output_chars=0):
+    # 노트북 섹션과 요약(원래 크기, 렌더링 크기, 셀/출력 수). 노트북으로 읽을 수 없으면 전체 섹션과 None
+    content = source.read(file_path)
+    try:
+        language, cells = read_notebook(content, keep_outputs=output_chars > 0)
+    except ValueError:
+        return render_file_section(source, file_path), None
+    rendered = render_notebook_cells(cells, language, output_chars).encode('utf-8')
+    code_cells = sum(1 for cell in cells if cell[0] == "code")
+    outputs = sum(cell[3] for cell in cells)
+    kept_outputs = sum(len(cell[2]) for cell in cells)
+    reduction = (1 - len(rendered) / len(content)) * 100 if content else 0.0
+    if output_chars > 0:
+        output_note = f"text of {kept_outputs} of {outputs} outputs kept (at most {output_chars} characters per cell), images and other data dropped"
+    else:
+        output_note = f"{outputs} outputs dropped"
+    header = section_header(file_path, language, f"Notebook: {code_cells} code and {len(cells) - code_cells} other cells, {output_note}, {len(content)} -> {len(rendered)} bytes ({reduction:.1f}% smaller)")
+    return [header, rendered, SECTION_FOOTER], {"mode": "notebook", "original": len(content), "rendered": len(rendered), "language": language}
+
+
+def strip_python_comments(source_code):
+    # tokenize의 COMMENT 토큰만 지운다 (문자열 안의 #은 그대로). 주석만 있던 줄은 줄째 지운다. 토큰화에 실패하면 None
+    lines = io.StringIO(source_code).readlines()
+    cuts = {}
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source_code).readline):
+            if token.type == tokenize.COMMENT:
+                cuts[token.start[0] - 1] = token.start[1]
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    output = []
+    for number, line in enumerate(lines):
+        if number not in cuts:
+            output.append(line)
+        elif line[:cuts[number]].strip():
+            output.append(line[:cuts[number]].rstrip() + "\n")
+    return "".join(output)
+
+
+def strip_brace_comments(source_code, quotes='"', token_pattern=None):
+    # // 와 /* */ 주석을 지운다. 줄 전체가 주석이면 줄째 지운다. token_pattern을 주면 quotes 대신 그 패턴으로 찾는다
+    output = []
+    position = 0
+    for match in (token_pattern or get_brace_token_pattern(quotes)).finditer(source_code):
+        if not match.group().startswith(('//', '/*')):
+            continue
+        start, end = match.span()
+        line_start = source_code.rfind("\n", 0, start) + 1
+        line_end = source_code.find("\n", end)
+        line_end = len(source_code) if line_end < 0 else line_end
+        if line_start >= position and not source_code[line_start:start].strip() and not source_code[end:line_end].strip():
+            start, end = line_start, min(line_end + 1, len(source_code))
+        output.append(source_code[position:start])
+        position = end
+    output.append(source_code[position:])
+    return "".join(output)
+
+
+def is_minified(file_path, source_code):
+    # 줄이 아주 긴 큰 JS/TS/CSS/JSON 파일은 압축된 번들이나 생성된 데이터로 본다
+    if os.path.splitext(file_path)[1].lower() not in MINIFIED_EXTENSIONS:
+        return False
+    return len(source_code) >= MINIFIED_MIN_BYTES and len(source_code) / (source_code.count("\n") + 1) >= MINIFIED_AVERAGE_LINE_LENGTH
+
+
+def normalize_source(file_path, source_code, strip_comments=True):
+    # 줄바꿈 통일 -> 압축 번들 생략 -> 주석 제거 -> 줄 끝 공백과 연속된 빈 줄 정리
+    source_code = source_code.replace("\r\n", "\n").replace("\r", "\n")
+    if is_minified(file_path, source_code):
+        return f"[minified bundle omitted: {len(source_code)} characters on {source_code.count(chr(10)) + 1} lines]"
+    _, ext = os.path.splitext(file_path)
+    if strip_comments and ext == '.py':
+        # 주석만 있는 파일(라이선스만 있는 __init__.py 등)은 빈 문자열이 정상 결과. None은 토큰화 실패
+        stripped = strip_python_comments(source_code)
+        if stripped is not None:
+            source_code = stripped
+    elif strip_comments and ext in NORMALIZE_COMMENT_QUOTES:
+        source_code = strip_brace_comments(source_code, NORMALIZE_COMMENT_QUOTES[ext])
+    elif strip_comments and ext == '.css':
+        source_code = strip_brace_comments(source_code, token_pattern=CSS_COMMENT_PATTERN)
+    source_code = TRAILING_WHITESPACE_PATTERN.sub("", source_code)
+    return BLANK_LINES_PATTERN.sub("\n\n", source_code).strip("\n")
+
+
+def normalize_section(source, file_path, parts, summary):
+    # 렌더링된 섹션의 내용을 정규화하고 요약에 전후 바이트/토큰 수를 더한다.
+    # 노트북은 마크다운 셀이 주석으로 들어 있어 주석은 지우지 않는다
+    header, content, footer = parts
+    if isinstance(content, str):
+        content = source.read(content)
+    notebook = bool(summary) and summary["mode"] == "notebook"
+    normalized = normalize_source(file_path, content.decode('utf-8', errors='replace'), strip_comments=not notebook).encode('utf-8')
+    if summary is None:
+        summary = full_section_summary(file_path, content)
+    summary["normalized"] = {
+        "bytes": (len(content), len(normalized)),
+        "tokens": (estimate_tokens(content), estimate_tokens(normalized)),
+        "minified": normalized.startswith(b"[minified bundle omitted:"),
+    }
+    return [header, normalized, footer], summary
+
+
+def hash_header_blocks(head, size):
+    # 파일 앞에서부터 줄을 하나씩 늘린 블록마다 (rolling hash, 바이트 수)
+    lines = head.split(b"\n")
+    if len(head) < size or not lines[-1]:
+        # 읽다 잘린 줄, 또는 마지막 줄바꿈 뒤의 빈 조각
+        lines.pop()
+    if not lines:
+        # 앞부분에 줄바꿈이 없다 (한 줄짜리 minified 파일 등)
+        return []
+    blocks = []
+    block_hash = 0
+    length = 0
+    for line in lines[:HEADER_MAX_LINES]:
+        block_hash = (block_hash * HEADER_HASH_BASE + hash(line)) % HEADER_HASH_MODULUS
+        length = min(length + len(line) + 1, size)
+        blocks.append((block_hash, length))
+    return blocks
+
+
+def hash_footer_blocks(tail, size):
+    # 파일 끝에서부터 줄을 하나씩 늘린 블록마다 (rolling hash, 바이트 수). 블록은 항상 파일 끝까지
+    lines = tail.split(b"\n")
+    if len(tail) < size:
+        lines.pop(0)
+    if not lines:
+        # 뒷부분에 줄바꿈이 없다 (한 줄짜리 minified 파일 등)
+        return []
+    trailing = lines.pop()
+    blocks = []
+    block_hash = hash(trailing) % HEADER_HASH_MODULUS
+    length = len(trailing)
+    for line in reversed(lines[-HEADER_MAX_LINES:]):
+        block_hash = (block_hash * HEADER_HASH_BASE + hash(line)) % HEADER_HASH_MODULUS
+        length += len(line) + 1
+        blocks.append((block_hash, length))
+    return blocks
+
+
+class CommonBlocks:
+    # 여러 파일에 반복되는 머리말/꼬리말 블록과 파일마다 떼어 낼 블록 번호
+    def __init__(self, blocks, assignments):
+        self.blocks = blocks
+        self.assignments = assignments
+
+    def reference(self, index):
+        block = self.blocks[index]
+        return f"[common {block['kind']} {index + 1}: {block['lines']} lines, see Common headers]\n".encode('utf-8')
+
+    def strip(self, file_path, content):
+        # 내용의 앞뒤 블록을 참조 한 줄로 바꾼다. 내용이 블록과 다르면(해시 충돌, skeleton 등) 그대로 둔다
+        assignment = self.assignments.get(file_path, {})
+        header = self.blocks[assignment["header"]]["content"] if "header" in assignment else None
+        footer = self.blocks[assignment["footer"]]["content"] if "footer" in assignment else None
+        prefix = suffix = b""
+        start, end = 0, len(content)
+        if header and content.startswith(header):
+            prefix = self.reference(assignment["header"])
+            start = len(header)
+        if footer and content.endswith(footer) and len(content) - len(footer) >= start:
+            suffix = self.reference(assignment["footer"])
+            end = len(content) - len(footer)
+        if not (prefix or suffix):
+            return content
+        return prefix + content[start:end] + suffix
+
+    def render(self):
+        body = ["The blocks below repeat at the start (header) or end (footer) of several files and are shown once here. Those files contain a one-line reference instead.\n\n"]
+        for index, block in enumerate(self.blocks, 1):
+            body.append(f"### Common {block['kind']} {index}: {block['lines']} lines, shared by {block['files']} files\n```{block['language']}\n")
+            # 블록을 그대로 쓴다 (끝의 빈 줄 포함). 참조를 블록으로 바꾸면 원래 파일이 된다
+            content = block["content"].decode('utf-8', errors='replace')
+            body.append(content if content.endswith("\n") else content + "\n")
+            body.append("```\n\n")
+        return "".join(body).encode('utf-8')
+
+
+def find_common_blocks(source, file_paths, progress=None):
+    # 파일마다 앞뒤 일부만 읽어 줄 단위 rolling hash 목록을 만들고, 모든 해시를 numpy로 한 번에 세어
+    # 파일마다 "(같은 블록을 가진 파일 수 - 1) x 크기"가 가장 큰 블록을 고른다. 파일 수에 거의 선형
+    candidates = [file_path for file_path in file_paths if not file_path.endswith('.ipynb')]
+    edges = {"header": ([], [], []), "footer": ([], [], [])}
+    read = lambda file_path: source.read_ends(file_path, HEADER_SCAN_BYTES)
+    for owner, (head, tail, size) in enumerate(render_in_order(read, candidates)):
+        for kind, blocks in (("header", hash_header_blocks(head, size)), ("footer", hash_footer_blocks(tail, size))):
+            hashes, lengths, owners = edges[kind]
+            for block_hash, length in blocks:
+                hashes.append(block_hash)
+                lengths.append(length)
+                owners.append(owner)
+        if (owner + 1) % 1000 == 0:
+            report_progress(progress, f"Scanned {owner + 1}/{len(candidates)} files for common headers...")
+    blocks = []
+    assignments = {}
+    for kind, (hashes, lengths, owners) in edges.items():
+        if not hashes:
+            continue
+        hashes = np.array(hashes, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+        owners = np.array(owners, dtype=np.int64)
+        _, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+        counts = counts[inverse]
+        savings = np.where((counts >= HEADER_MIN_FILES) & (lengths >= HEADER_MIN_BYTES), (counts - 1) * lengths, 0)
+        # 파일 순서대로, 파일 안에서는 절감량이 큰 순서로 정렬해 파일마다 첫 번째를 고른다
+        order = np.lexsort((-savings, owners))
+        first = order[np.r_[True, owners[order][1:] != owners[order][:-1]]]
+        users = {}
+        for position in first[savings[first] > 0]:
+            users.setdefault((int(hashes[position]), int(lengths[position])), []).append(candidates[owners[position]])
+        for (_, length), block_files in users.items():
+            # 다른 파일들이 더 긴 블록을 골라 혼자 남은 블록은 버린다
+            if len(block_files) < 2:
+                continue
+            head, tail, _ = source.read_ends(block_files[0], HEADER_SCAN_BYTES)
+            content = head[:length] if kind == "header" else tail[len(tail) - length:]
+            for file_path in block_files:
+                assignments.setdefault(file_path, {})[kind] = len(blocks)
+            blocks.append({
+                "kind": kind,
+                "content": content,
+                "lines": content.count(b"\n") + (not content.endswith(b"\n")),
+                "files": len(block_files),
+                "language": get_language_by_extension(block_files[0]),
+            })
+    return CommonBlocks(blocks, assignments)
+
+
+def strip_common_blocks(source, file_path, parts, summary, common_blocks):
+    # 섹션 내용에서 공통 머리말/꼬리말을 떼어 낸다. 떼어 낼 블록이 없는 파일은 원래 섹션 그대로 (큰 파일도 읽지 않음)
+    if file_path not in common_blocks.assignments:
+        return parts, summary
+    header, content, footer = parts
+    if isinstance(content, str):
+        content = source.read(content)
+    stripped = common_blocks.strip(file_path, content)
+    if summary is None:
+        summary = full_section_summary(file_path, content)
+    summary["common_blocks"] = len(content) - len(stripped)
+    return [header, stripped, footer], summary
+
+
+def render_merge_section(source, file_path, options, common_blocks=None):
+    # Merge 옵션에 맞는 파일 섹션과 요약. 원문 그대로 쓰는 섹션은 요약이 None
+    if file_path.endswith('.ipynb'):
+        parts, summary = render_notebook_section(source, file_path, int(options["notebook_output_chars"] or 0))
+    elif options["output_mode"] == "skeleton":
+        parts, summary = render_skeleton_section(source, file_path)
+    else:
+        parts, summary = render_file_section(source, file_path), None
+    if common_blocks is not None:
+        # 정규화는 공백을 바꾸므로 그 전에 떼어 낸다
+        parts, summary = strip_common_blocks(source, file_path, parts, summary, common_blocks)
+    if options["normalize"]:
+        # 렌더링 스레드에서 바로 이어서 처리한다 (문서를 다시 읽는 별도 단계 없음)
+        parts, summary = normalize_section(source, file_path, parts, summary)
+    return parts, summary
+
+
+SECTION_INDEX_VERSION = 1
+
+
+def get_section_index_path(markdown_path):
+    return markdown_path + ".index.json"
+
+
+class SectionIndexWriter:
+    # 문서에 쓰면서 섹션마다 바이트 오프셋을 기록한다. copy_into는 버퍼를 거치지 않으므로 tell() 대신 직접 센다
+    def __init__(self, out_file, source):
+        self.out_file = out_file
+        self.source = source
+        self.offset = 0
+        self.sections = []
+
+    def write(self, kind, header, content, footer, path=None, language=None, content_hash=None):
+        start = self.offset
+        if content_hash is None and not isinstance(content, str):
+            content_hash = get_content_hash(content)
+        self.out_file.write(header)
+        if isinstance(content, str):
+            content_length = self.source.copy_into(content, self.out_file)
+        else:
+            self.out_file.write(content)
+            content_length = len(content)
+        self.out_file.write(footer)
+        self.offset += len(header) + content_length + len(footer)
+        self.sections.append({
+            "kind": kind,
+            "path": path,
+            "language": language,
+            "offset": start,
+            "length": self.offset - start,
+            "content_offset": start + len(header),
+            "content_length": content_length,
+            "hash": content_hash,
+        })
+
+    def save(self, markdown_path):
+        # 문서가 rename된 뒤에 쓴다. 읽는 쪽은 size로 문서와 짝이 맞는지 확인
+        index = {"version": SECTION_INDEX_VERSION, "document": os.path.basename(markdown_path), "size": self.offset, "sections": self.sections}
+        with AtomicOutputFile(get_section_index_path(markdown_path)) as index_file:
+            json.dump(index, index_file)
+
+
+# 바이트 종류: 0 영문자/_, 1 숫자, 2 공백/줄바꿈, 3 그 밖의 ASCII 기호, 4 비ASCII 바이트
+TOKEN_BYTE_CLASSES = np.full(256, 3, dtype=np.uint8)
+TOKEN_BYTE_CLASSES[[ord(c) for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_"]] = 0
+TOKEN_BYTE_CLASSES[[ord(c) for c in "0123456789"]] = 1
+TOKEN_BYTE_CLASSES[[ord(c) for c in " \t\r\n\f\v"]] = 2
+TOKEN_BYTE_CLASSES[0x80:] = 4
+# 종류별 구간 가중치: 단어/숫자는 글자 수를 나눠 올림, 기호와 비ASCII는 바이트 수에 비례
+TOKEN_RUN_DIVISORS = np.array([TOKEN_WORD_CHARS, TOKEN_DIGIT_CHARS, 1, 1, 1], dtype=np.int64)
+TOKEN_RUN_IS_COUNTED = np.array([1, 1, 0, 0, 0], dtype=np.int64)
+TOKEN_RUN_BYTE_WEIGHTS = np.array([0, 0, 0, TOKEN_PUNCTUATION_WEIGHT, 1 / TOKEN_NON_ASCII_BYTES])
+
+
+def estimate_tokens_batch(buffers):
+    # 여러 조각을 한 배열로 이어 붙여 numpy로 한 번에 센다. 같은 종류의 바이트가 이어진 구간(run) 단위로 토큰을 매긴다
+    count = len(buffers)
+    lengths = np.fromiter(map(len, buffers), dtype=np.int64, count=count)
+    if not count or not lengths.sum():
+        return [0] * count
+    data = np.frombuffer(b"".join(buffers), dtype=np.uint8)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    classes = TOKEN_BYTE_CLASSES[data]
+    # 종류가 바뀌는 곳과 조각의 시작이 구간 경계
+    boundaries = np.empty(len(data), dtype=bool)
+    boundaries[0] = True
+    np.not_equal(classes[1:], classes[:-1], out=boundaries[1:])
+    boundaries[starts[lengths > 0]] = True
+    run_starts = np.flatnonzero(boundaries)
+    run_lengths = np.diff(np.append(run_starts, len(data)))
+    run_classes = classes[run_starts]
+    weights = TOKEN_RUN_IS_COUNTED[run_classes] * (1 + (run_lengths - 1) // TOKEN_RUN_DIVISORS[run_classes])
+    weights = weights + run_lengths * TOKEN_RUN_BYTE_WEIGHTS[run_classes]
+    # 단어 앞의 공백 한 칸은 단어 토큰에 붙는다. 들여쓰기나 줄바꿈 묶음은 한 토큰
+    first_bytes = data[run_starts]
+    weights += (run_classes == 2) & ((run_lengths > 1) | (first_bytes == ord('\n')) | (first_bytes == ord('\r')))
+    owners = np.searchsorted(starts, run_starts, side='right') - 1
+    tokens = np.bincount(owners, weights=weights, minlength=count)
+    return [int(math.ceil(value)) for value in tokens]
+
+
+def estimate_tokens(text):
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return sum(estimate_tokens_batch([data[start:start + TOKEN_BATCH_BYTES] for start in range(0, len(data), TOKEN_BATCH_BYTES)] or [b""]))
+
+
+def count_section_tokens(markdown_path, sections, progress=None):
+    # 섹션마다 "tokens"(머리말 포함)와 "content_tokens"를 채운다. 내용 토큰 수는 내용 해시로 캐시해 다시 세지 않는다
+    cache = MetricsCache()
+    stats = {"sections": len(sections), "hits": 0}
+    try:
+        cached = cache.get_tokens([section["hash"] for section in sections if section["hash"]])
+        with open(markdown_path, 'rb') as document_file:
+            document = mmap.mmap(document_file.fileno(), 0, access=mmap.ACCESS_READ) if sections else None
+            try:
+                # 머리말/꼬리는 작으므로 전부 한 번에 센다
+                overheads = [
+                    document[section["offset"]:section["content_offset"]] + document[section["content_offset"] + section["content_length"]:section["offset"] + section["length"]]
+                    for section in sections
+                ]
+                for section, overhead_tokens in zip(sections, estimate_tokens_batch(overheads)):
+                    section["tokens"] = overhead_tokens
+                pending = []
+                for section in sections:
+                    content_tokens = cached.get(section["hash"])
+                    if content_tokens is None:
+                        pending.append(section)
+                    else:
+                        section["content_tokens"] = content_tokens
+                        stats["hits"] += 1
+                # 캐시에 없는 내용을 TOKEN_BATCH_BYTES 단위로 묶어 센다 (큰 섹션은 여러 조각으로)
+                batch, owners, batch_size = [], [], 0
+                new_counts = {}
+
+                def flush():
+                    for owner, piece_tokens in zip(owners, estimate_tokens_batch(batch)):
+                        owner["content_tokens"] = owner.get("content_tokens", 0) + piece_tokens
+                    batch.clear()
+                    owners.clear()
+
+                for done, section in enumerate(pending, 1):
+                    section["content_tokens"] = 0
+                    end = section["content_offset"] + section["content_length"]
+                    for start in range(section["content_offset"], end, TOKEN_BATCH_BYTES):
+                        piece = document[start:min(start + TOKEN_BATCH_BYTES, end)]
+                        batch.append(piece)
+                        owners.append(section)
+                        batch_size += len(piece)
+                        if batch_size >= TOKEN_BATCH_BYTES:
+                            flush()
+                            batch_size = 0
+                            report_progress(progress, f"Counted tokens in {done}/{len(pending)} sections...")
+                flush()
+                for section in pending:
+                    if section["hash"]:
+                        new_counts[section["hash"]] = section["content_tokens"]
+            finally:
+                if document is not None:
+                    document.close()
+        cache.put_tokens(new_counts.items())
+    finally:
+        cache.close()
+    for section in sections:
+        section["tokens"] += section["content_tokens"]
+    return stats
+
+
+def get_file_token_counts(source, file_paths, file_hashes=None):
+    # 파일 내용의 토큰 수. Merge에서 센 값이 해시로 캐시되어 있으면 파일을 읽지 않는다
+    file_hashes = dict(file_hashes or {})
+    cache = MetricsCache()
+    try:
+        cached = cache.get_tokens([file_hashes[file_path] for file_path in file_paths if file_path in file_hashes])
+        counts = {file_path: cached[file_hashes[file_path]] for file_path in file_paths if file_hashes.get(file_path) in cached}
+        pending = [file_path for file_path in file_paths if file_path not in counts]
+        new_counts = []
+        for batch_start in range(0, len(pending), ANALYSIS_BATCH_SIZE):
+            batch = pending[batch_start:batch_start + ANALYSIS_BATCH_SIZE]
+            contents = [source.read(file_path) for file_path in batch]
+            for file_path, content, tokens in zip(batch, contents, estimate_tokens_batch(contents)):
+                counts[file_path] = tokens
+                new_counts.append((file_hashes.get(file_path) or get_content_hash(content), tokens))
+        cache.put_tokens(new_counts)
+    finally:
+        cache.close()
+    return counts
+
+
+def get_shard_paths(markdown_path):
+    base, _ = os.path.splitext(markdown_path)
+    return base + ".part{:03d}.md", base + ".shards.json"
+
+
+def remove_shards(markdown_path):
+    # 이전 Merge가 남긴 shard와 shard 목록
+    shard_pattern, shard_manifest_path = get_shard_paths(markdown_path)
+    shard_prefix = os.path.basename(shard_pattern.split('{')[0])
+    merged_dir = os.path.dirname(markdown_path)
+    for name in os.listdir(merged_dir):
+        if name.startswith(shard_prefix) and name.endswith(".md"):
+            os.remove(os.path.join(merged_dir, name))
+    if os.path.exists(shard_manifest_path):
+        os.remove(shard_manifest_path)
+
+
+def write_shards(markdown_path, repo_url, shard_tokens, progress=None):
+    # 섹션을 문서 순서대로 담아 shard_tokens 이하의 파일들로 나눈다. 섹션은 나누지 않으며,
+    # 혼자서 예산을 넘는 섹션은 단독 shard가 된다(oversized). 원래 제목 대신 각 shard에 "part i/n" 제목을 붙인다
+    shard_pattern, shard_manifest_path = get_shard_paths(markdown_path)
+    remove_shards(markdown_path)
+    document = MergedDocument(markdown_path)
+    try:
+        title_tokens = estimate_tokens(f"# GitHub Repository: {repo_url} (part 000 of 000)\n\n")
+        groups = [[]]
+        used = title_tokens
+        for section in document.sections:
+            if section["kind"] == "title":
+                continue
+            if groups[-1] and used + section["tokens"] > shard_tokens:
+                groups.append([])
+                used = title_tokens
+            groups[-1].append(section)
+            used += section["tokens"]
+        shards = []
+        for number, group in enumerate(groups, 1):
+            shard_path = shard_pattern.format(number)
+            title = f"# GitHub Repository: {repo_url} (part {number} of {len(groups)})\n\n"
+            with AtomicOutputFile(shard_path, 'wb') as shard_file:
+                shard_file.write(title.encode('utf-8'))
+                for section in group:
+                    shard_file.write(document.read_section(section))
+            tokens = title_tokens + sum(section["tokens"] for section in group)
+            shards.append({
+                "path": os.path.basename(shard_path),
+                "tokens": tokens,
+                "bytes": os.path.getsize(shard_path),
+                "oversized": tokens > shard_tokens,
+                "sections": [{"kind": section["kind"], "path": section["path"], "tokens": section["tokens"]} for section in group],
+            })
+            report_progress(progress, f"Wrote shard {number}/{len(groups)}...")
+    finally:
+        document.close()
+    with AtomicOutputFile(shard_manifest_path) as manifest_file:
+        json.dump({"document": os.path.basename(markdown_path), "shard_tokens": shard_tokens, "estimator": TOKEN_ESTIMATOR_VERSION, "shards": shards}, manifest_file, indent=2)
+    return shard_manifest_path, shards
+
+
+class MergedDocument:
+    # 병합 문서를 mmap으로 열고 섹션 색인으로 필요한 부분만 꺼낸다 (문서 전체를 읽거나 검색하지 않음)
+    def __init__(self, markdown_path):
+        with open(get_section_index_path(markdown_path)) as index_file:
+            index = json.load(index_file)
+        if index.get("version") != SECTION_INDEX_VERSION:
+            raise ValueError(f"Unsupported section index version: {index.get('version')}")
+        self.file = open(markdown_path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size != index["size"]:
+                raise ValueError(f"Section index does not match {markdown_path}")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        self.sections = index["sections"]
+        self.by_key = {(section["kind"], section["path"]): section for section in self.sections}
+
+    def find(self, kind, path=None):
+        return self.by_key.get((kind, path))
+
+    def first(self, kind):
+        return next((section for section in self.sections if section["kind"] == kind), None)
+
+    def read_section(self, section):
+        return self.map[section["offset"]:section["offset"] + section["length"]]
+
+    def read_content(self, section):
+        return self.map[section["content_offset"]:section["content_offset"] + section["content_length"]]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def render_in_order(render, items, workers=None, window=None):
+    # 스레드 풀에서 렌더링하고, 제한된 크기의 재정렬 버퍼로 원래 순서대로 돌려준다
+    if workers is None:
+        workers = MERGE_WORKERS
+    if workers <= 1:
+        for item in items:
+            yield render(item)
+        return
+    window = window or workers * 4
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="codecollector-render") as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(render, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def combine_code_files_to_markdown(repo_url, downloaded_files, source, workspace=None, progress=None, merge_options=None, file_hashes=None):
+    options = {**DEFAULT_MERGE_OPTIONS, **(merge_options or {})}
+    repo_name = repo_url.rstrip('/').split('/')[-1]
+    merged_dir = get_workspace_dir(workspace, "merged")
     os.makedirs(merged_dir, exist_ok=True)
     markdown_document_path = os.path.join(merged_dir, f"{repo_name}.md")
-    repo_structure_content = ""
-    with open(markdown_document_path, 'w') as md_file:
-        md_file.write(f"# GitHub Repository: {repo_url}\n\n")
-        md_file.write("## Repository Structure\n")
-        for file_path in downloaded_files:
-            md_file.write(f"- {file_path}\n")
-            repo_structure_content += f"- {file_path}\n"
-        md_file.write("\n")
+    repo_structure_content = "".join(f"- {file_path}\n" for file_path in downloaded_files)
+    # 바이너리 모드로 쓰고 큰 파일 내용은 source.copy_into로 그대로 이어 붙인다 (sendfile/copy_file_range)
+    with AtomicOutputFile(markdown_document_path, 'wb') as md_file:
+        # 섹션별 바이트 오프셋은 <문서>.index.json에 따로 기록
+        writer = SectionIndexWriter(md_file, source)
+        writer.write("title", f"# GitHub Repository: {repo_url}\n\n".encode('utf-8'), b"", b"")
+        writer.write("structure", b"## Repository Structure\n", repo_structure_content.encode('utf-8'), b"\n")
         readme_file = None
         for file_path in downloaded_files:
             if file_path.lower() == 'readme.md':
                 readme_file = file_path
                 break
         if readme_file:
-            md_file.write("## README.md\n")
-            with open(os.path.join(os.getcwd(), "down_code", readme_file), 'r') as readme:
-                readme_content = readme.read()
-                md_file.write(readme_content)
-            md_file.write("\n\n")
-            arxiv_pdf_texts = download_and_extract_arxiv_pdfs(readme_content)
+            readme_bytes = source.read(readme_file)
+            writer.write("readme", b"## README.md\n", readme_bytes, b"\n\n", path=readme_file, language="markdown", content_hash=(file_hashes or {}).get(readme_file))
+            arxiv_pdf_texts = download_and_extract_arxiv_pdfs(
+                readme_bytes.decode('utf-8', errors='replace'), progress,
+                max_pages=options["arxiv_max_pages"], sections=options["arxiv_sections"], drop_references=options["arxiv_drop_references"],
+            )
             if arxiv_pdf_texts:
-                md_file.write("## Extracted Text from arXiv PDFs\n")
-                md_file.write(arxiv_pdf_texts)
-                md_file.write("\n\n")
-        for file_path in downloaded_files:
-            if file_path != readme_file:
-                language = get_language_by_extension(file_path)
-                md_file.write(f"## File: {file_path}\n")
-                md_file.write(f"### Language: {language}\n")
-                md_file.write(f"### Description:\n")
-                md_file.write(f"This file contains the implementation of...\n\n")
-                md_file.write(f"### Code:\n")
-                md_file.write(f"```{language}\n")
-                with open(os.path.join(os.getcwd(), "down_code", file_path), 'r') as code_file:
-                    code_content = code_file.read()
-                    md_file.write(code_content)
-                md_file.write("\n```\n\n")
-    return f"Combined Markdown document created at: {markdown_document_path}", repo_structure_content
+                writer.write("arxiv", b"## Extracted Text from arXiv PDFs\n", arxiv_pdf_texts.encode('utf-8'), b"\n\n")
+        code_files = [file_path for file_path in downloaded_files if file_path != readme_file]
+        common_blocks = None
+        if options["dedupe_headers"]:
+            report_progress(progress, "Finding common headers...")
+            # skeleton은 주석 등 원문과 달라 블록이 맞지 않으므로, skeleton으로 렌더링할 파일은 찾지 않는다
+            dedupe_files = [file_path for file_path in code_files if not (options["output_mode"] == "skeleton" and has_skeleton(file_path))]
+            common_blocks = find_common_blocks(source, dedupe_files, progress)
+            if common_blocks.blocks:
+                writer.write("common_headers", b"## Common headers\n", common_blocks.render(), b"\n")
+        render = lambda file_path: render_merge_section(source, file_path, options, common_blocks)
+        deduped_files = 0
+        deduped_bytes = 0
+        # 방식(skeleton, notebook)별 [파일 수, 원래 크기, 렌더링 크기]
+        reductions = {}
+        notebooks = []
+        # 언어별 정규화 결과 [파일 수, 전/후 바이트, 전/후 토큰, 생략한 번들 수]
+        normalization = {}
+        for index, (file_path, (parts, summary)) in enumerate(zip(code_files, render_in_order(render, code_files)), start=1):
+            if summary and "normalized" in summary:
+                normalized = summary["normalized"]
+                totals = normalization.setdefault(summary["language"], [0, 0, 0, 0, 0, 0])
+                totals[0] += 1
+                totals[1] += normalized["bytes"][0]
+                totals[2] += normalized["bytes"][1]
+                totals[3] += normalized["tokens"][0]
+                totals[4] += normalized["tokens"][1]
+                totals[5] += normalized["minified"]
+            if summary and summary.get("common_blocks"):
+                deduped_files += 1
+                deduped_bytes += summary["common_blocks"]
+            if summary and summary["mode"] != "full":
+                totals = reductions.setdefault(summary["mode"], [0, 0, 0])
+                totals[0] += 1
+                totals[1] += summary["original"]
+                totals[2] += summary["rendered"]
+                if summary["mode"] == "notebook":
+                    notebooks.append((file_path, summary["original"], summary["rendered"]))
+            if index % 100 == 0 or index == len(code_files):
+                report_progress(progress, f"Merged {index}/{len(code_files)} files...")
+            # 원문 그대로 쓴 섹션은 manifest의 해시를 그대로 쓴다 (큰 파일도 다시 읽지 않음)
+            writer.write(
+                "file", *parts, path=file_path,
+                language=summary["language"] if summary else get_language_by_extension(file_path),
+                content_hash=None if summary else (file_hashes or {}).get(file_path),
+            )
+    shard_tokens = int(options["shard_tokens"] or 0)
+    token_stats = None
+    if options["count_tokens"] or shard_tokens > 0:
+        report_progress(progress, "Counting tokens...")
+        token_stats = count_section_tokens(markdown_document_path, writer.sections, progress)
+    writer.save(markdown_document_path)
+    message = f"Combined Markdown document created at: {markdown_document_path}"
+    if token_stats:
+        total_tokens = sum(section["tokens"] for section in writer.sections)
+        message += f"\nEstimated tokens: {total_tokens} ({token_stats['hits']}/{token_stats['sections']} section counts reused from cache)."
+    if shard_tokens <= 0:
+        remove_shards(markdown_document_path)
+    else:
+        shard_manifest_path, shards = write_shards(markdown_document_path, repo_url, shard_tokens, progress)
+        message += f"\nSplit into {len(shards)} shards of at most {shard_tokens} tokens, listed in {shard_manifest_path}."
+        oversized = [shard for shard in shards if shard["oversized"]]
+        if oversized:
+            message += f" {len(oversized)} shards hold a single section larger than the budget: " + ", ".join(shard["path"] for shard in oversized) + "."
+    for mode, (count, original_size, rendered_size) in reductions.items():
+        message += f"\n{mode.capitalize()}: {count} files reduced from {original_size} to {rendered_size} bytes ({(1 - rendered_size / original_size) * 100 if original_size else 0.0:.1f}% smaller)."
+    # 노트북별 감소량은 각 섹션 머리말에도 있다. 메시지에는 많이 줄어든 순으로 일부만
+    notebooks.sort(key=lambda notebook: notebook[2] - notebook[1])
+    for file_path, original_size, rendered_size in notebooks[:NOTEBOOK_REPORT_LIMIT]:
+        message += f"\n  {file_path}: {original_size} -> {rendered_size} bytes ({(1 - rendered_size / original_size) * 100 if original_size else 0.0:.1f}% smaller)"
+    if len(notebooks) > NOTEBOOK_REPORT_LIMIT:
+        message += f"\n  ... and {len(notebooks) - NOTEBOOK_REPORT_LIMIT} more notebooks."
+    if common_blocks is not None:
+        message += f"\nCommon headers: {len(common_blocks.blocks)} blocks shown once, references in {deduped_files} files ({deduped_bytes} bytes saved)."
+    if normalization:
+        saved_bytes = sum(totals[1] - totals[2] for totals in normalization.values())
+        saved_tokens = sum(totals[3] - totals[4] for totals in normalization.values())
+        message += f"\nNormalization saved {saved_bytes} bytes and about {saved_tokens} tokens:"
+        for language, (count, bytes_before, bytes_after, tokens_before, tokens_after, minified) in sorted(normalization.items(), key=lambda item: item[1][4] - item[1][3]):
+            message += (
+                f"\n  {language}: {count} files, {bytes_before} -> {bytes_after} bytes ({(1 - bytes_after / bytes_before) * 100 if bytes_before else 0.0:.1f}% smaller), "
+                f"{tokens_before} -> {tokens_after} tokens ({(1 - tokens_after / tokens_before) * 100 if tokens_before else 0.0:.1f}% fewer)"
+                + (f", {minified} minified bundles omitted" if minified else "")
+            )
+    return message, repo_structure_content
 
 
 def get_language_by_extension(file_path):
@@ -175,92 +2289,696 @@ def get_language_by_extension(file_path):
     return extension_to_language.get(ext, 'plaintext')
 
 
-def extract_core_code(repo_url):
-    merged_dir = os.path.join(os.getcwd(), "merged")
-    repo_name = repo_url.split('/')[-1]
+def is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def is_import_block(node):
+    # try: import x / except ImportError: x = None, if TYPE_CHECKING: import y 같은 import 전용 블록
+    for child in ast.walk(node):
+        if isinstance(child, (ast.stmt, ast.excepthandler)) and not isinstance(child, (ast.Import, ast.ImportFrom, ast.Pass, ast.Assign, ast.If, ast.Try, ast.ExceptHandler)):
+            return False
+    return True
+
+
+def is_constant_assignment(node, in_class):
+    # 모듈의 대문자 이름/__all__ 할당, 클래스 본문의 속성 선언
+    if not isinstance(node, (ast.Assign, ast.AnnAssign)):
+        return False
+    if in_class:
+        return True
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    return all(isinstance(target, ast.Name) and (target.id.isupper() or target.id == "__all__") for target in targets)
+
+
+def outline_python_source(source_code, keep_lines=(), docstrings=True, constants=True):
+    # AST의 줄 범위로 원문을 잘라 import, class/def 시그니처(+docstring, 상수)만 남기고 본문은 "..."로 줄인다.
+    # keep_lines에 def 줄 번호가 있는 함수는 본문까지 그대로 둔다. 파싱할 수 없으면 None
+    try:
+        tree = ast.parse(source_code)
+    except (SyntaxError, ValueError):
+        return None
+    lines = source_code.split('\n')
+    output = []
+    last_line = [0]
+
+    def first_line(node):
+        # 데코레이터가 있으면 데코레이터 줄부터
+        return min([decorator.lineno for decorator in getattr(node, "decorator_list", [])] + [node.lineno])
+
+    def emit(start, end):
+        # 원문에서 떨어진 위치면 빈 줄 하나로 구분
+        if output and start > last_line[0] + 1:
+            output.append("")
+        output.extend(lines[start - 1:end])
+        last_line[0] = end
+
+    def emit_elided(body):
+        first = lines[body[0].lineno - 1]
+        output.append(first[:body[0].col_offset] + "...")
+
+    def emit_definition(node, in_class):
+        is_function = isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        if (is_function and node.lineno in keep_lines) or node.body[0].lineno == node.lineno:
+            emit(first_line(node), node.end_lineno)
+            return
+        emit(first_line(node), first_line(node.body[0]) - 1)
+        body = node.body
+        if is_docstring(body[0]):
+            if docstrings:
+                emit(body[0].lineno, body[0].end_lineno)
+            elif len(body) == 1:
+                emit_elided(body)
+            body = body[1:]
+        if not body:
+            return
+        if is_function:
+            emit_elided(body)
+            return
+        emitted = len(output)
+        emit_body(body, in_class=True)
+        if len(output) == emitted:
+            emit_elided(body)
+
+    def emit_body(body, in_class):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                emit_definition(node, in_class)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)) and not in_class:
+                emit(node.lineno, node.end_lineno)
+            elif isinstance(node, (ast.If, ast.Try)) and not in_class and is_import_block(node):
+                emit(node.lineno, node.end_lineno)
+            elif constants and is_constant_assignment(node, in_class):
+                emit(node.lineno, node.end_lineno)
+
+    body = tree.body
+    if body and is_docstring(body[0]):
+        if docstrings:
+            emit(body[0].lineno, body[0].end_lineno)
+        body = body[1:]
+    emit_body(body, in_class=False)
+    return "\n".join(output)
+
+
+def collect_imports(tree):
+    # (모듈, 상대 import 단계, import한 이름들). 모듈 해석은 저장소 전체를 알아야 하므로 import 그래프에서 한다
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name, 0, []) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append((node.module or "", node.level, [alias.name for alias in node.names if alias.name != "*"]))
+    return imports
+
+
+def analyze_python_file(file_path, source_code):
+    # 프로세스 풀에서 실행: 파일 하나의 줄 수, 원시 지표, radon 복잡도, import 목록. 파싱에 실패해도 예외 대신 error로 돌려준다
+    start = time.perf_counter()
+    result = {"path": file_path, "lines": len(source_code.split('\n')), "complexity": 0, "blocks": [], "imports": [], "raw": None, "error": None}
+    try:
+        tree = ast.parse(source_code)
+        blocks = cc_visit_ast(tree)
+        result["imports"] = collect_imports(tree)
+        result["raw"] = raw_analyze(source_code)._asdict()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    else:
+        result["blocks"] = [(block.fullname, block.lineno, block.endline, block.complexity) for block in blocks]
+        result["complexity"] = sum(block.complexity for block in blocks)
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def get_content_hash(content):
+    # manifest와 같은 git blob id
+    return hashlib.sha1(f"blob {len(content)}\0".encode('ascii') + content).hexdigest()
+
+
+class MetricsCache:
+    # 파일 내용 해시 단위로 분석 결과를 저장하므로 다른 브랜치/포크에서도 바뀐 파일만 다시 분석한다
+    def __init__(self, path=None):
+        path = path or METRICS_CACHE_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metrics (content_hash TEXT NOT NULL, analyzer_version TEXT NOT NULL, result TEXT NOT NULL, PRIMARY KEY (content_hash, analyzer_version))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS tokens (content_hash TEXT NOT NULL, estimator_version TEXT NOT NULL, tokens INTEGER NOT NULL, PRIMARY KEY (content_hash, estimator_version))")
+
+    def get_many(self, content_hashes):
+        found = {}
+        unique_hashes = list(set(content_hashes))
+        for start in range(0, len(unique_hashes), 500):
+            chunk = unique_hashes[start:start + 500]
+            query = f"SELECT content_hash, result FROM metrics WHERE analyzer_version = ? AND content_hash IN ({','.join('?' * len(chunk))})"
+            for content_hash, result in self.connection.execute(query, [ANALYZER_VERSION] + chunk):
+                found[content_hash] = json.loads(result)
+        return found
+
+    def put_many(self, items):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO metrics (content_hash, analyzer_version, result) VALUES (?, ?, ?)",
+                [(content_hash, ANALYZER_VERSION, json.dumps({key: value for key, value in result.items() if key != "path"})) for content_hash, result in items],
+            )
+
+    def get_tokens(self, content_hashes):
+        found = {}
+        unique_hashes = list(set(content_hashes))
+        for start in range(0, len(unique_hashes), 500):
+            chunk = unique_hashes[start:start + 500]
+            query = f"SELECT content_hash, tokens FROM tokens WHERE estimator_version = ? AND content_hash IN ({','.join('?' * len(chunk))})"
+            found.update(self.connection.execute(query, [TOKEN_ESTIMATOR_VERSION] + chunk))
+        return found
+
+    def put_tokens(self, items):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tokens (content_hash, estimator_version, tokens) VALUES (?, ?, ?)",
+                [(content_hash, TOKEN_ESTIMATOR_VERSION, tokens) for content_hash, tokens in items],
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def analyze_python_files(source, file_paths, pool=None, workers=None, progress=None, file_hashes=None, use_cache=True):
+    # 캐시에 없는 파일만 묶음 단위로 읽어 프로세스 풀에 chunk로 나눠 보내고, 결과는 입력 순서대로 모은다
+    workers = PROCESS_WORKERS if workers is None else workers
+    file_hashes = dict(file_hashes or {})
+    stats = {"files": len(file_paths), "hits": 0, "time_saved": 0.0}
+    cache = MetricsCache() if use_cache else None
+    results = {}
+    try:
+        if cache and file_hashes:
+            cached = cache.get_many([file_hashes[file_path] for file_path in file_paths if file_path in file_hashes])
+            for file_path in file_paths:
+                result = cached.get(file_hashes.get(file_path))
+                if result is not None:
+                    results[file_path] = {**result, "path": file_path}
+                    stats["hits"] += 1
+                    stats["time_saved"] += result.get("elapsed", 0.0)
+        pending = [file_path for file_path in file_paths if file_path not in results]
+        for batch_start in range(0, len(pending), ANALYSIS_BATCH_SIZE):
+            batch = pending[batch_start:batch_start + ANALYSIS_BATCH_SIZE]
+            contents = [source.read(file_path) for file_path in batch]
+            source_codes = [content.decode('utf-8', errors='replace') for content in contents]
+            if workers <= 1:
+                batch_results = list(map(analyze_python_file, batch, source_codes))
+            else:
+                chunksize = max(1, len(batch) // (workers * 4))
+                shared_pool = pool or get_process_pool()
+                try:
+                    batch_results = list(shared_pool.map(analyze_python_file, batch, source_codes, chunksize=chunksize))
+                except BrokenProcessPool:
+                    # 워커가 죽어 깨진 공유 풀은 버리고 새 풀로 한 번 더 시도한다
+                    if pool is not None:
+                        raise
+                    reset_process_pool(shared_pool)
+                    shared_pool = get_process_pool()
+                    try:
+                        batch_results = list(shared_pool.map(analyze_python_file, batch, source_codes, chunksize=chunksize))
+                    except BrokenProcessPool:
+                        reset_process_pool(shared_pool)
+                        raise
+            for file_path, content, result in zip(batch, contents, batch_results):
+                file_hashes.setdefault(file_path, get_content_hash(content))
+                results[file_path] = result
+            if cache:
+                cache.put_many([(file_hashes[file_path], result) for file_path, result in zip(batch, batch_results)])
+            report_progress(progress, f"Analyzed {stats['hits'] + batch_start + len(batch)}/{len(file_paths)} Python files...")
+    finally:
+        if cache:
+            cache.close()
+    return [results[file_path] for file_path in file_paths], stats
+
+
+def score_core_files(results, import_graph, coverage_ratios=None):
+    # 각 지표를 저장소 안 최댓값으로 0~1 정규화한 뒤 가중합. 복잡도와 크기는 몇몇 큰 파일이 지배하지 않도록 log를 취한다
+    weights = dict(CORE_SCORE_WEIGHTS)
+    if coverage_ratios is None:
+        weights.pop("coverage")
+    total_weight = sum(weights.values()) or 1.0
+    features = {
+        "complexity": {result["path"]: math.log1p(result["complexity"]) for result in results},
+        "centrality": {result["path"]: import_graph.centrality.get(result["path"], 0.0) for result in results},
+        "size": {result["path"]: math.log1p(result["lines"]) for result in results},
+        "coverage": {result["path"]: (coverage_ratios or {}).get(result["path"], 0.0) for result in results},
+    }
+    scores = dict.fromkeys((result["path"] for result in results), 0.0)
+    for name, weight in weights.items():
+        largest = max(features[name].values(), default=0.0) or 1.0
+        for file_path, value in features[name].items():
+            scores[file_path] += weight / total_weight * value / largest
+    return scores
+
+
+def select_top_k(scores, costs, budget):
+    # 점수 높은 순으로 꺼내 예산에 들어가는 파일을 담는다 (들어가지 않는 파일은 건너뛰고 계속)
+    heap = [(-score, file_path) for file_path, score in scores.items()]
+    heapq.heapify(heap)
+    selected = []
+    remaining = budget
+    while heap and remaining > 0:
+        _, file_path = heapq.heappop(heap)
+        if costs[file_path] <= remaining:
+            selected.append(file_path)
+            remaining -= costs[file_path]
+    return selected
+
+
+def select_knapsack(scores, costs, budget):
+    # 0/1 knapsack. 비용을 KNAPSACK_RESOLUTION 칸으로 올림해 나누므로 예산을 넘지 않는다
+    unit = max(1, math.ceil(budget / KNAPSACK_RESOLUTION))
+    capacity = budget // unit
+    items = [(file_path, costs[file_path] // unit + (costs[file_path] % unit > 0), score) for file_path, score in scores.items() if score > 0 and costs[file_path] <= budget]
+    best = [0.0] * (capacity + 1)
+    taken = []
+    for _, weight, score in items:
+        if weight > capacity:
+            taken.append(None)
+            continue
+        candidates = [value + score for value in best[:capacity + 1 - weight]]
+        take = bytearray(capacity + 1)
+        for w, candidate in enumerate(candidates, weight):
+            if candidate > best[w]:
+                take[w] = 1
+        best[weight:] = [max(current, candidate) for current, candidate in zip(best[weight:], candidates)]
+        taken.append(take)
+    selected = []
+    w = capacity
+    for (file_path, weight, _), take in zip(reversed(items), reversed(taken)):
+        if take is not None and take[w]:
+            selected.append(file_path)
+            w -= weight
+    return selected
+
+
+CORE_SELECTORS = {
+    "knapsack": select_knapsack,
+    "top-k": select_top_k,
+}
+
+
+def extract_core_code(repo_url, downloaded_files, source, workspace=None, progress=None, file_hashes=None, coverage_ratios=None, core_options=None):
+    options = {**DEFAULT_CORE_OPTIONS, **(core_options or {})}
+    merged_dir = get_workspace_dir(workspace, "merged")
+    repo_name = repo_url.rstrip('/').split('/')[-1]
     combined_md_file = os.path.join(merged_dir, f"{repo_name}.md")
     core_md_file = os.path.join(merged_dir, f"core_{repo_name}.md")
 
-    if not os.path.exists(combined_md_file):
+    # 병합 문서의 섹션 색인으로 구조와 README만 읽는다
+    try:
+        document = MergedDocument(combined_md_file)
+    except (OSError, ValueError):
         return f"No combined Markdown file found for the repository: {repo_url}. Please merge the code files first."
+    try:
+        structure_section = document.first("structure")
+        readme_section = document.first("readme")
+        repo_structure = document.read_content(structure_section).decode('utf-8', errors='replace') if structure_section else ""
+        readme_content = document.read_content(readme_section).decode('utf-8', errors='replace') if readme_section else ""
+    finally:
+        document.close()
+
+    report_progress(progress, "Analyzing Python files...")
+    python_files = [file_path for file_path in downloaded_files if file_path.endswith(".py")]
+    results, cache_stats = analyze_python_files(source, python_files, progress=progress, file_hashes=file_hashes)
+    failed = [result for result in results if result["error"]]
+    parsed = [result for result in results if not result["error"]]
+    import_graph = ImportGraph(parsed)
+
+    header = f"# Core Code Files for Repository: {repo_url}\n\n"
+    header += f"## Repository Structure\n{repo_structure}\n"
+    header += f"## README.md\n{readme_content}\n"
+    if import_graph.edges:
+        header += "## Module Dependencies\n"
+        header += "| File | Imported by | Imports | Centrality |\n|---|---|---|---|\n"
+        for file_path in import_graph.most_central(20):
+            header += f"| {file_path} | {import_graph.fan_in[file_path]} | {import_graph.fan_out[file_path]} | {import_graph.centrality[file_path]:.4f} |\n"
+        header += "\n"
+
+    def section_costs(texts):
+        if options["budget_unit"] == "bytes":
+            return [len(text.encode('utf-8')) for text in texts]
+        return estimate_tokens_batch([text.encode('utf-8') for text in texts])
+
+    function_level = options["granularity"] == "functions"
+
+    def hot_function_lines(result):
+        return {lineno for _, lineno, _, complexity in result["blocks"] if complexity > CORE_FUNCTION_COMPLEXITY_THRESHOLD}
 
-    core_code_files = []
-    total_lines = 0
+    def render_core_code(result):
+        code = source.read(result["path"]).decode('utf-8', errors='replace')
+        if function_level:
+            # 복잡한 함수는 그대로, 나머지는 import와 시그니처만
+            outline = outline_python_source(code, keep_lines=hot_function_lines(result), docstrings=False, constants=False)
+            if outline is not None:
+                code = outline
+        return code
+
+    rendered = {}
+    budget = int(options["budget"] or 0)
+    if budget > 0:
+        # 예산에서 머리말(구조, README, 의존성 표)을 빼고 남은 만큼 점수 높은 파일을 담는다
+        scores = score_core_files(parsed, import_graph, coverage_ratios)
+        parsed_paths = [result["path"] for result in parsed]
+        overheads = dict(zip(parsed_paths, section_costs([f"## File: {file_path}\n```python\n\n```\n\n" for file_path in parsed_paths])))
+        if function_level:
+            # 줄인 결과의 크기로 비용을 매겨야 하므로 후보를 미리 렌더링한다
+            rendered = {result["path"]: render_core_code(result) for result in parsed}
+            code_costs = dict(zip(parsed_paths, section_costs([rendered[file_path] for file_path in parsed_paths])))
+        elif options["budget_unit"] == "bytes":
+            code_costs = {file_path: source.size(file_path) for file_path in parsed_paths}
+        else:
+            code_costs = get_file_token_counts(source, parsed_paths, file_hashes)
+        costs = {file_path: overheads[file_path] + code_costs[file_path] for file_path in parsed_paths}
+        remaining = budget - section_costs([header])[0]
+        selected = set(CORE_SELECTORS[options["selection"]](scores, costs, remaining)) if remaining > 0 else set()
+        core_results = [result for result in parsed if result["path"] in selected]
+    else:
+        core_results = [
+            result for result in parsed
+            if (hot_function_lines(result) if function_level else result["complexity"] > CORE_COMPLEXITY_THRESHOLD)
+            or is_highly_dependent(result["path"], import_graph)
+            or (coverage_ratios is not None and is_high_coverage(result["path"], coverage_ratios))
+        ]
+    total_lines = sum(result["lines"] for result in results)
     core_lines = 0
-    repo_structure = ""
-    readme_content = ""
-
-    with open(combined_md_file, 'r') as combined_md:
-        content = combined_md.read()
-        repo_structure_match = re.search(r"## Repository Structure\n(.*?)\n##", content, re.DOTALL)
-        if repo_structure_match:
-            repo_structure = repo_structure_match.group(1)
-        readme_match = re.search(r"## README\.md\n(.*?)\n##", content, re.DOTALL)
-        if readme_match:
-            readme_content = readme_match.group(1)
-
-    for root, dirs, files in os.walk(os.path.join(os.getcwd(), "down_code")):
-        for file in files:
-            if file.endswith(".py"):
-                file_path = os.path.join(root, file)
-                with open(file_path, "r") as f:
-                    source_code = f.read()
-                    total_lines += len(source_code.split('\n'))
-                    tree = ast.parse(source_code)
-                    if is_complex(tree, complexity_threshold=25):
-                        core_code_files.append(file_path)
-                        core_lines += len(source_code.split('\n'))
-
-    with open(core_md_file, 'w') as core_md:
-        core_md.write(f"# Core Code Files for Repository: {repo_url}\n\n")
-        core_md.write(f"## Repository Structure\n{repo_structure}\n")
-        core_md.write(f"## README.md\n{readme_content}\n")
-        for file_path in core_code_files:
-            core_md.write(f"## File: {file_path}\n")
+    full_size = 0
+    core_size = 0
+
+    with AtomicOutputFile(core_md_file) as core_md:
+        core_md.write(header)
+        for result in core_results:
+            code = rendered.pop(result["path"], None)
+            if code is None:
+                code = render_core_code(result)
+            core_lines += len(code.split('\n'))
+            full_size += source.size(result["path"])
+            core_size += len(code.encode('utf-8'))
+            core_md.write(f"## File: {result['path']}\n")
             core_md.write(f"```python\n")
-            with open(file_path, 'r') as code_file:
-                code_content = code_file.read()
-                core_md.write(code_content)
+            core_md.write(code)
             core_md.write("\n```\n\n")
 
-    removal_percentage = (1 - core_lines / total_lines) * 100
-    return f"Core code Markdown document created at: {core_md_file}. Removed {removal_percentage:.2f}% of the code."
+    removal_percentage = (1 - core_lines / total_lines) * 100 if total_lines else 0.0
+    message = f"Core code Markdown document created at: {core_md_file}. Removed {removal_percentage:.2f}% of the code."
+    if function_level and full_size:
+        message += f"\nFunction-level: kept functions with complexity above {CORE_FUNCTION_COMPLEXITY_THRESHOLD}, reducing the selected files from {full_size} to {core_size} bytes ({(1 - core_size / full_size) * 100:.1f}% smaller)."
+    if budget > 0:
+        if options["budget_unit"] == "bytes":
+            used = os.path.getsize(core_md_file)
+        else:
+            with open(core_md_file, 'rb') as core_md:
+                used = estimate_tokens(core_md.read())
+        message += f"\nSelected {len(core_results)}/{len(parsed)} Python files with {options['selection']}: {used} of {budget} {options['budget_unit']} used."
+        if section_costs([header])[0] > budget:
+            message += " The repository structure and README alone exceed the budget."
+    if cache_stats["files"]:
+        hit_rate = cache_stats["hits"] / cache_stats["files"] * 100
+        message += f"\nAnalysis cache: {cache_stats['hits']}/{cache_stats['files']} files reused ({hit_rate:.1f}% hit rate), saved {cache_stats['time_saved']:.2f}s of analysis."
+        edge_count = sum(import_graph.fan_out.values())
+        dependent_count = sum(1 for result in core_results if is_highly_dependent(result["path"], import_graph))
+        message += f"\nImport graph: {len(import_graph.edges)} modules, {edge_count} internal imports, {dependent_count} core files imported by more than {CORE_FAN_IN_THRESHOLD} files."
+    if failed:
+        message += f"\nSkipped {len(failed)} files that could not be parsed:\n" + "\n".join(f"- {result['path']}: {result['error']}" for result in failed)
+    return message
     
 
-def is_complex(tree, complexity_threshold):
-    complexity_score = sum([fn.complexity for fn in cc_visit(tree)])
-    return complexity_score > complexity_threshold
+# 하위 프로세스에 자원 제한을 건 뒤 실제 명령으로 exec한다 (스레드가 있는 서버에서 preexec_fn을 쓰지 않기 위해)
+SANDBOX_LAUNCHER = """
+import os, sys, resource
+memory_limit, cpu_limit = int(sys.argv[1]), int(sys.argv[2])
+if memory_limit:
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+os.execv(sys.executable, [sys.executable] + sys.argv[3:])
+"""
 
-    
-    
+# 테스트가 없는 저장소는 모듈 import만으로 측정한다. 모듈 하나가 실패해도 나머지는 계속
+IMPORT_MODULES_SCRIPT = """
+import sys, importlib
+for module_name in sys.argv[1:]:
+    try:
+        importlib.import_module(module_name)
+    except BaseException as e:
+        print(f"{module_name}: {type(e).__name__}: {e}", file=sys.stderr)
+"""
+
+
+def materialize_python_files(source, file_paths, dest_dir):
+    # git 객체 DB에서 읽는 경우처럼 작업 트리가 없을 때, 측정에 필요한 Python 파일만 풀어 놓는다
+    for file_path in file_paths:
+        dest_path = os.path.join(dest_dir, file_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open(dest_path, 'wb') as dest:
+            source.copy_into(file_path, dest)
+    return dest_dir
 
-def is_high_coverage(file_path, cov):
-    cov.start()
+
+def run_sandboxed(command, cwd, env, timeout=None):
+    # 새 세션(프로세스 그룹)에서 실행해 제한 시간이 지나면 테스트가 띄운 자식 프로세스까지 함께 종료한다
+    timeout = COVERAGE_TIMEOUT if timeout is None else timeout
+    launcher = [sys.executable, "-c", SANDBOX_LAUNCHER, str(COVERAGE_MEMORY_LIMIT), str(int(timeout) + 1)]
+    process = subprocess.Popen(launcher + command, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
     try:
-        with open(file_path, 'r') as file:
-            code = compile(file.read(), file_path, 'exec')
-            try:
-                exec(code, {'__name__': '__main__'})
-            except SystemExit:
-                pass
-    except Exception as e:
-        pass
-    cov.stop()
-    cov.save()
-    analysis_result = cov.analysis(file_path)
-    missing_lines = analysis_result[2]
-    cov.erase()
-    return len(missing_lines) == 0
+        _, errors = process.communicate(timeout=timeout)
+        return process.returncode, errors.decode('utf-8', errors='replace')
+    except subprocess.TimeoutExpired:
+        # SIGTERM을 먼저 보내 coverage가 그때까지의 데이터를 저장하게 하고, 끝나지 않으면 강제 종료
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+        return None, f"timed out after {timeout:.0f}s"
+
+
+def measure_coverage(source, file_paths, root=None, workspace=None, workers=None, progress=None):
+    # 테스트(또는 모듈 import)를 여러 하위 프로세스에서 나눠 실행하고, 작업별 데이터 파일을 합쳐 파일별 커버리지 비율을 구한다
+    workers = COVERAGE_WORKERS if workers is None else workers
+    python_files = [file_path for file_path in file_paths if file_path.endswith(".py")]
+    coverage_dir = get_workspace_dir(workspace, "coverage")
+    shutil.rmtree(coverage_dir, ignore_errors=True)
+    data_dir = os.path.join(coverage_dir, "data")
+    os.makedirs(data_dir)
+    if root is None:
+        report_progress(progress, "Preparing files for coverage...")
+        root = materialize_python_files(source, python_files, os.path.join(coverage_dir, "src"))
+    root = os.path.realpath(root)
+    rcfile_path = os.path.join(coverage_dir, "coveragerc")
+    with open(rcfile_path, 'w') as rcfile:
+        rcfile.write("[run]\nsigterm = true\n")
+    script_path = os.path.join(coverage_dir, "import_modules.py")
+    with open(script_path, 'w') as script:
+        script.write(IMPORT_MODULES_SCRIPT)
+
+    test_files = [file_path for file_path in python_files if TEST_FILE_PATTERN.search(file_path)]
+    if test_files and importlib.util.find_spec("pytest"):
+        items = test_files
+        runner = ["-m", "pytest", "-q", "-p", "no:cacheprovider"]
+    elif test_files:
+        items = [get_module_name(file_path) for file_path in test_files]
+        runner = ["-m", "unittest"]
+    else:
+        items = [get_module_name(file_path) for file_path in python_files if not file_path.endswith("setup.py")]
+        runner = [script_path]
+    task_count = max(1, min(len(items), workers * 2))
+    tasks = [items[i::task_count] for i in range(task_count)]
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "HOME": coverage_dir,
+        "PYTHONPATH": root,
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "PYTHONHASHSEED": "0",
+    }
+
+    def run_task(index):
+        data_file = os.path.join(data_dir, f".coverage.{index}")
+        command = ["-m", "coverage", "run", f"--rcfile={rcfile_path}", f"--data-file={data_file}", f"--source={root}"] + runner + tasks[index]
+        return run_sandboxed(command, root, env)
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(run_task, index) for index in range(len(tasks))]
+        for done, future in enumerate(futures, 1):
+            returncode, errors = future.result()
+            if returncode is None:
+                failures.append(errors)
+            report_progress(progress, f"Measured coverage {done}/{len(tasks)} tasks...")
+
+    stats = {"mode": "tests" if test_files else "imports", "tasks": len(tasks), "timeouts": len(failures)}
+    data_files = [os.path.join(data_dir, name) for name in os.listdir(data_dir)]
+    if not data_files:
+        return {}, stats
+    cov = coverage.Coverage(data_file=os.path.join(coverage_dir, ".coverage"))
+    cov.combine(data_files, keep=False)
+    # 테스트 파일은 자기 자신을 실행해 늘 커버되고, 문장이 없는 파일(빈 __init__.py 등)은 비율이 의미가 없으므로 둘 다 빼 둔다
+    ratios = {}
+    for file_path in python_files:
+        if TEST_FILE_PATTERN.search(file_path):
+            continue
+        try:
+            _, statements, _, missing, _ = cov.analysis2(os.path.join(root, file_path))
+        except Exception:
+            continue
+        if statements:
+            ratios[file_path] = 1.0 - len(missing) / len(statements)
+    return ratios, stats
+
+
+def is_high_coverage(file_path, coverage_ratios, threshold=None):
+    threshold = CORE_COVERAGE_THRESHOLD if threshold is None else threshold
+    return coverage_ratios.get(file_path, 0.0) >= threshold
     
     
 
-def is_highly_dependent(file_path):
-    graph = ModuleGraph()
-    graph.run_script(file_path)
-    num_dependencies = len([edge for edge in graph.edges() if edge[0].identifier == file_path])
-    return num_dependencies > 5
+def get_module_name(file_path):
+    # "pkg/sub/mod.py" -> "pkg.sub.mod", "pkg/__init__.py" -> "pkg"
+    parts = file_path[:-len(".py")].split('/')
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
 
 
+class ImportGraph:
+    # 분석 결과의 import 목록으로 만든 저장소 내부 모듈 그래프. 표준 라이브러리/외부 패키지는 해석하지 않고 버린다
+    def __init__(self, results):
+        self.modules = {get_module_name(result["path"]): result["path"] for result in results}
+        # __init__.py가 있는 디렉토리 (패키지)
+        self.packages = {os.path.dirname(result["path"]) for result in results if os.path.basename(result["path"]) == "__init__.py"}
+        # src/ 레이아웃처럼 앞쪽 디렉토리가 패키지가 아닌 경우에만, 그 디렉토리를 뗀 겹치지 않는 접미 모듈 이름으로도 찾는다
+        suffixes = {}
+        for module_name, file_path in self.modules.items():
+            parts = module_name.split('.')
+            for i in range(1, len(parts)):
+                if "/".join(parts[:i]) in self.packages:
+                    break
+                suffixes.setdefault(".".join(parts[i:]), set()).add(file_path)
+        self.suffixes = {name: paths.pop() for name, paths in suffixes.items() if len(paths) == 1}
+        self.edges = {result["path"]: set() for result in results}
+        for result in results:
+            for module, level, names in result.get("imports", []):
+                for target in self.resolve(result["path"], module, level, names):
+                    if target != result["path"]:
+                        self.edges[result["path"]].add(target)
+        self.fan_out = {file_path: len(targets) for file_path, targets in self.edges.items()}
+        self.fan_in = dict.fromkeys(self.edges, 0)
+        for targets in self.edges.values():
+            for target in targets:
+                self.fan_in[target] += 1
+        self.centrality = self.pagerank()
+
+    def find(self, module_name, importer_dir=None):
+        # 패키지가 아닌 디렉토리의 스크립트는 같은 디렉토리의 모듈을 먼저, 다음으로 저장소 루트 기준 이름, 마지막으로 유일한 접미 이름.
+        # 표준 라이브러리 이름(logging, typing 등)은 저장소 루트 기준으로만 찾는다 (같은 이름의 패키지 내부 모듈과 잇지 않음)
+        if module_name.split('.')[0] in sys.stdlib_module_names:
+            return self.modules.get(module_name)
+        if importer_dir and importer_dir not in self.packages:
+            file_path = self.modules.get(f"{importer_dir.replace('/', '.')}.{module_name}")
+            if file_path:
+                return file_path
+        return self.modules.get(module_name) or self.suffixes.get(module_name)
+
+    def resolve(self, importer, module, level, names):
+        if level:
+            package = get_module_name(importer).split('.')
+            if not importer.endswith("__init__.py"):
+                package.pop()
+            if level - 1 > len(package):
+                return []
+            base = package[:len(package) - (level - 1)]
+            module_name = ".".join(base + ([module] if module else []))
+            # 상대 import는 위치가 정해져 있으므로 접미 이름으로 찾지 않는다
+            candidates = [self.modules.get(f"{module_name}.{name}" if module_name else name) for name in names]
+            if not any(candidates):
+                candidates = [self.modules.get(module_name)]
+            return [candidate for candidate in candidates if candidate]
+        importer_dir = os.path.dirname(importer)
+        # "from pkg import mod"는 서브모듈 import일 수 있으므로 pkg.mod부터 찾는다
+        targets = [self.find(f"{module}.{name}", importer_dir) for name in names]
+        targets = [target for target in targets if target]
+        if not targets:
+            target = self.find(module, importer_dir)
+            targets = [target] if target else []
+        return targets
+
+    def pagerank(self):
+        # import되는 쪽으로 점수가 흐른다. 밖으로 나가는 간선이 없는 파일의 점수는 모든 파일에 고르게 나눈다
+        nodes = list(self.edges)
+        if not nodes:
+            return {}
+        count = len(nodes)
+        rank = dict.fromkeys(nodes, 1.0 / count)
+        for _ in range(PAGERANK_ITERATIONS):
+            dangling = sum(rank[node] for node in nodes if not self.edges[node])
+            base = (1.0 - PAGERANK_DAMPING) / count + PAGERANK_DAMPING * dangling / count
+            next_rank = dict.fromkeys(nodes, base)
+            for node in nodes:
+                targets = self.edges[node]
+                if targets:
+                    share = PAGERANK_DAMPING * rank[node] / len(targets)
+                    for target in targets:
+                        next_rank[target] += share
+            converged = sum(abs(next_rank[node] - rank[node]) for node in nodes) < 1e-9
+            rank = next_rank
+            if converged:
+                break
+        return rank
+
+    def most_central(self, limit):
+        return sorted(self.centrality, key=self.centrality.get, reverse=True)[:limit]
+
+
+def is_highly_dependent(file_path, import_graph, fan_in_threshold=None):
+    fan_in_threshold = CORE_FAN_IN_THRESHOLD if fan_in_threshold is None else fan_in_threshold
+    return import_graph.fan_in.get(file_path, 0) > fan_in_threshold
+
+
+
+def run_extract_job(path, file_extensions, clone_strategy, workspace, manifest, progress=None):
+    return get_or_extract_code_files(path, file_extensions, clone_strategy, manifest, workspace, progress)
+
+
+def run_merge_job(path, file_extensions, clone_strategy, merge_options, workspace, manifest, progress=None):
+    _, manifest = get_or_extract_code_files(path, file_extensions, clone_strategy, manifest, workspace, progress)
+    if not manifest or not manifest["files"]:
+        return "No files to combine. Please extract files first.", manifest
+    downloaded_files = [entry["path"] for entry in manifest["files"]]
+    source = open_manifest_source(manifest)
+    try:
+        file_hashes = {entry["path"]: entry["hash"] for entry in manifest["files"]}
+        markdown_path, repo_structure = combine_code_files_to_markdown(path, downloaded_files, source, workspace, progress, merge_options, file_hashes)
+    finally:
+        source.close()
+    title = "Repository Structure" if path.startswith('https://github.com') else "Folder Structure"
+    return f"{markdown_path}\n\n## {title}\n{repo_structure}", manifest
+
+
+def run_core_job(path, file_extensions, clone_strategy, core_options, workspace, manifest, progress=None):
+    message, manifest = get_or_extract_code_files(path, file_extensions, clone_strategy, manifest, workspace, progress)
+    if manifest is None:
+        return message, manifest
+    downloaded_files = [entry["path"] for entry in manifest["files"]]
+    source = open_manifest_source(manifest)
+    try:
+        file_hashes = {entry["path"]: entry["hash"] for entry in manifest["files"]}
+        coverage_ratios = None
+        coverage_message = ""
+        if (core_options or {}).get("measure_coverage"):
+            report_progress(progress, "Measuring test coverage...")
+            # 로컬 폴더는 그 자리에서, git 객체 DB에서 읽는 경우는 작업 공간에 풀어서 실행
+            root = manifest["root"] if manifest["backend"] == "directory" else None
+            coverage_ratios, coverage_stats = measure_coverage(source, downloaded_files, root, workspace, progress=progress)
+            coverage_message = f"\nCoverage ({coverage_stats['mode']}, {coverage_stats['tasks']} tasks): measured {len(coverage_ratios)} files"
+            if coverage_stats["timeouts"]:
+                coverage_message += f", {coverage_stats['timeouts']} tasks timed out"
+            coverage_message += "."
+        return extract_core_code(path, downloaded_files, source, workspace, progress, file_hashes, coverage_ratios, core_options) + coverage_message, manifest
+    finally:
+        source.close()
+
 
 def setup_gradio_interface():
     with gr.Blocks() as interface:
@@ -275,57 +2993,117 @@ def setup_gradio_interface():
             combine_button = gr.Button("Merge to Markdown")
             core_button = gr.Button("Extract Core Code")
             clear_button = gr.Button("Clear Output")
+        with gr.Row():
+            clone_strategy_input = gr.Dropdown(label="Clone Strategy", choices=CLONE_STRATEGIES, value="mirror")
+        with gr.Accordion("Core Options", open=False):
+            with gr.Row():
+                core_budget_input = gr.Number(label="Core: Budget (0 = threshold rules)", value=DEFAULT_CORE_OPTIONS["budget"], precision=0, minimum=0)
+                core_budget_unit_input = gr.Dropdown(label="Core: Budget Unit", choices=CORE_BUDGET_UNITS, value=DEFAULT_CORE_OPTIONS["budget_unit"])
+                core_selection_input = gr.Dropdown(label="Core: Selection", choices=CORE_SELECTION_METHODS, value=DEFAULT_CORE_OPTIONS["selection"])
+                core_granularity_input = gr.Dropdown(label="Core: Granularity", choices=CORE_GRANULARITIES, value=DEFAULT_CORE_OPTIONS["granularity"])
+                # 저장소 코드를 실행하므로 기본값은 꺼 둔다
+                measure_coverage_input = gr.Checkbox(label="Core: Measure Test Coverage (runs the repository's tests)", value=DEFAULT_CORE_OPTIONS["measure_coverage"])
+        with gr.Accordion("Merge Options", open=False):
+            with gr.Row():
+                arxiv_max_pages_input = gr.Number(label="arXiv: Max Pages per Paper (0 = all)", value=0, precision=0, minimum=0)
+                arxiv_sections_input = gr.CheckboxGroup(label="arXiv: Keep Sections (none = all)", choices=PDF_SECTION_CHOICES, value=[])
+                arxiv_drop_references_input = gr.Checkbox(label="arXiv: Drop References and Appendices", value=False)
+                count_tokens_input = gr.Checkbox(label="Count Tokens", value=DEFAULT_MERGE_OPTIONS["count_tokens"])
+                shard_tokens_input = gr.Number(label="Shard Size in Tokens (0 = single file)", value=DEFAULT_MERGE_OPTIONS["shard_tokens"], precision=0, minimum=0)
+                output_mode_input = gr.Dropdown(label="Output Mode (skeleton = signatures, docstrings and constants only)", choices=MERGE_OUTPUT_MODES, value=DEFAULT_MERGE_OPTIONS["output_mode"])
+                normalize_input = gr.Checkbox(label="Normalize Source (strip comments, trailing whitespace, extra blank lines, CRLF; omit minified bundles)", value=DEFAULT_MERGE_OPTIONS["normalize"])
+                dedupe_headers_input = gr.Checkbox(label="Deduplicate Common Headers (license banners, generated preambles)", value=DEFAULT_MERGE_OPTIONS["dedupe_headers"])
+                notebook_output_chars_input = gr.Number(label="Notebooks: Text Output Characters per Cell (0 = drop outputs)", value=DEFAULT_MERGE_OPTIONS["notebook_output_chars"], precision=0, minimum=0)
         output_text = gr.Textbox(label="Output", lines=10, interactive=False)
+        # 세션별 작업 공간과 추출 결과(manifest). Extract 후 Merge/Core에서 재사용
+        workspace_state = gr.State(None, delete_callback=remove_workspace)
+        manifest_state = gr.State(None)
+        
+        job_queue = JobQueue()
+
+        def stream_job(fn, workspace, manifest, *args):
+            # 작업을 큐에 넣고 진행 상황을 UI로 흘려보낸다
+            try:
+                job = job_queue.submit(fn, *args, workspace, manifest, key=workspace)
+            except (JobQueueFull, WorkspaceBusy) as e:
+                yield f"Error: {e}", workspace, manifest
+                return
+            for message in job.stream():
+                yield message, workspace, manifest
+            if job.error is not None:
+                yield f"Error: {job.error}", workspace, manifest
+                return
+            message, manifest = job.result
+            yield message, workspace, manifest
         
-        def extract_files(repo_url, local_folder, file_extensions):
+        def extract_files(repo_url, local_folder, file_extensions, clone_strategy, workspace, manifest):
+            workspace = ensure_workspace(workspace)
             file_extensions = [ext.strip() for ext in file_extensions.split(',')]
             if repo_url:
                 # GitHub URL인 경우
                 if not re.match(r'^https://github\.com/[a-zA-Z0-9_-]+/[a-zA-Z0-9_-]+/?$', repo_url):
-                    return "Error: Invalid GitHub repository URL.", []
-                message, _ = extract_code_files(repo_url, file_extensions)
+                    yield "Error: Invalid GitHub repository URL.", workspace, manifest
+                    return
+                yield from stream_job(run_extract_job, workspace, manifest, repo_url, file_extensions, clone_strategy)
             elif local_folder:
                 # 로컬 폴더 경로인 경우
                 # 로컬 폴더 경로 유효성 검증이 필요한 경우 여기에 추가
-                message, _ = extract_code_files(local_folder, file_extensions)
+                yield from stream_job(run_extract_job, workspace, manifest, local_folder, file_extensions, clone_strategy)
             else:
-                message = "Please provide either a GitHub repository URL or a local folder path."
-            return message
+                yield "Please provide either a GitHub repository URL or a local folder path.", workspace, manifest
 
         
-        def merge_to_markdown(repo_url, local_folder, file_extensions):
-            if repo_url:
-                file_extensions = [ext.strip() for ext in file_extensions.split(',')]
-                _, downloaded_files = extract_code_files(repo_url, file_extensions)
-                if downloaded_files:
-                    markdown_path, repo_structure = combine_code_files_to_markdown(repo_url, downloaded_files)
-                    return f"{markdown_path}\n\n## Repository Structure\n{repo_structure}"
-            elif local_folder:
-                file_extensions = [ext.strip() for ext in file_extensions.split(',')]
-                _, downloaded_files = extract_code_files(local_folder, file_extensions)
-                if downloaded_files:
-                    markdown_path, repo_structure = combine_code_files_to_markdown(local_folder, downloaded_files)
-                    return f"{markdown_path}\n\n## Folder Structure\n{repo_structure}"
-            return "No files to combine. Please extract files first."
+        def merge_to_markdown(repo_url, local_folder, file_extensions, clone_strategy, workspace, manifest, arxiv_max_pages, arxiv_sections, arxiv_drop_references, output_mode, count_tokens, shard_tokens, notebook_output_chars, normalize, dedupe_headers):
+            workspace = ensure_workspace(workspace)
+            path = repo_url or local_folder
+            if not path:
+                yield "No files to combine. Please extract files first.", workspace, manifest
+                return
+            file_extensions = [ext.strip() for ext in file_extensions.split(',')]
+            merge_options = {
+                "arxiv_max_pages": int(arxiv_max_pages or 0),
+                "arxiv_sections": arxiv_sections,
+                "arxiv_drop_references": arxiv_drop_references,
+                "output_mode": output_mode,
+                "count_tokens": count_tokens,
+                "shard_tokens": int(shard_tokens or 0),
+                "notebook_output_chars": int(notebook_output_chars or 0),
+                "normalize": normalize,
+                "dedupe_headers": dedupe_headers,
+            }
+            yield from stream_job(run_merge_job, workspace, manifest, path, file_extensions, clone_strategy, merge_options)
         
-        def extract_core(repo_url, local_folder):
-            if repo_url:
-                message = extract_core_code(repo_url)
-            elif local_folder:
-                message = extract_core_code(local_folder)
-            else:
-                message = "Please provide either a GitHub repository URL or a local folder path."
-            return message
+        def extract_core(repo_url, local_folder, file_extensions, clone_strategy, workspace, manifest, core_budget, core_budget_unit, core_selection, core_granularity, measure_test_coverage):
+            workspace = ensure_workspace(workspace)
+            path = repo_url or local_folder
+            if not path:
+                yield "Please provide either a GitHub repository URL or a local folder path.", workspace, manifest
+                return
+            file_extensions = [ext.strip() for ext in file_extensions.split(',')]
+            core_options = {
+                "budget": int(core_budget or 0),
+                "budget_unit": core_budget_unit,
+                "selection": core_selection,
+                "granularity": core_granularity,
+                "measure_coverage": measure_test_coverage,
+            }
+            yield from stream_job(run_core_job, workspace, manifest, path, file_extensions, clone_strategy, core_options)
         
-        extract_button.click(fn=extract_files, inputs=[repo_url_input, local_folder_input, file_extensions_input], outputs=output_text)
-        combine_button.click(fn=merge_to_markdown, inputs=[repo_url_input, local_folder_input, file_extensions_input], outputs=output_text)
-        core_button.click(fn=extract_core, inputs=[repo_url_input, local_folder_input], outputs=output_text)
+        inputs = [repo_url_input, local_folder_input, file_extensions_input, clone_strategy_input, workspace_state, manifest_state]
+        merge_inputs = inputs + [arxiv_max_pages_input, arxiv_sections_input, arxiv_drop_references_input, output_mode_input, count_tokens_input, shard_tokens_input, notebook_output_chars_input, normalize_input, dedupe_headers_input]
+        core_inputs = inputs + [core_budget_input, core_budget_unit_input, core_selection_input, core_granularity_input, measure_coverage_input]
+        outputs = [output_text, workspace_state, manifest_state]
+        # 동시 실행 제한은 JobQueue가 담당
+        extract_button.click(fn=extract_files, inputs=inputs, outputs=outputs, concurrency_limit=None)
+        combine_button.click(fn=merge_to_markdown, inputs=merge_inputs, outputs=outputs, concurrency_limit=None)
+        core_button.click(fn=extract_core, inputs=core_inputs, outputs=outputs, concurrency_limit=None)
         clear_button.click(lambda: "", None, output_text)
     
     return interface
 
 
 
-interface = setup_gradio_interface()
-interface.launch()
+if __name__ == "__main__":
+    interface = setup_gradio_interface()
+    interface.launch()
 
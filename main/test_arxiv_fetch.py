@@ -0,0 +1,134 @@
+import os
+import asyncio
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz
+import httpx
+
+import run_24
+from run_24 import fetch_pdf, fetch_pdfs, download_and_extract_arxiv_pdfs
+
+
+def build_pdf(text):
+    # 한 쪽짜리 샘플 PDF (메모리에서 생성)
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((72, 72), text)
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+
+class PdfServer:
+    # arXiv 대신 쓰는 로컬 HTTP 서버. 경로마다 (상태 코드, 본문) 응답 목록을 차례로 돌려주고, 마지막 응답은 계속 반복한다
+    def __init__(self, routes):
+        self.routes = {path: list(responses) for path, responses in routes.items()}
+        self.requests = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                    responses = server.routes.get(self.path, [(404, b"not found")])
+                    status, body = responses.pop(0) if len(responses) > 1 else responses[0]
+                self.send_response(status)
+                self.send_header("Content-Type", "application/pdf" if status == 200 else "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def fetch_one(url, retries=3):
+    async def run():
+        async with httpx.AsyncClient(timeout=5) as client:
+            return await fetch_pdf(client, {}, url, retries=retries, backoff=0)
+    return asyncio.run(run())
+
+
+class FetchPdfTest(unittest.TestCase):
+    def test_fetches_pdf_into_memory(self):
+        pdf_bytes = build_pdf("Sample paper")
+        with PdfServer({"/paper.pdf": [(200, pdf_bytes)]}) as server:
+            self.assertEqual(fetch_one(server.url("/paper.pdf")), pdf_bytes)
+            self.assertEqual(server.requests["/paper.pdf"], 1)
+
+    def test_fetches_many_pdfs_concurrently_in_order(self):
+        pdfs = {f"/paper{i}.pdf": build_pdf(f"Sample paper {i}") for i in range(6)}
+        with PdfServer({path: [(200, pdf_bytes)] for path, pdf_bytes in pdfs.items()}) as server:
+            contents = asyncio.run(fetch_pdfs([server.url(path) for path in pdfs]))
+        self.assertEqual(contents, list(pdfs.values()))
+
+    def test_not_found_is_not_retried(self):
+        with PdfServer({}) as server:
+            self.assertIsNone(fetch_one(server.url("/missing.pdf")))
+            self.assertEqual(server.requests["/missing.pdf"], 1)
+
+    def test_client_error_is_not_retried(self):
+        with PdfServer({"/forbidden.pdf": [(403, b"forbidden")]}) as server:
+            self.assertIsNone(fetch_one(server.url("/forbidden.pdf")))
+            self.assertEqual(server.requests["/forbidden.pdf"], 1)
+
+    def test_server_error_is_retried(self):
+        pdf_bytes = build_pdf("Sample paper")
+        with PdfServer({"/flaky.pdf": [(503, b"busy"), (500, b"error"), (200, pdf_bytes)]}) as server:
+            self.assertEqual(fetch_one(server.url("/flaky.pdf")), pdf_bytes)
+            self.assertEqual(server.requests["/flaky.pdf"], 3)
+
+    def test_gives_up_after_retries(self):
+        with PdfServer({"/down.pdf": [(502, b"bad gateway")]}) as server:
+            self.assertIsNone(fetch_one(server.url("/down.pdf"), retries=2))
+            self.assertEqual(server.requests["/down.pdf"], 3)
+
+
+class DownloadAndExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.saved = run_24.ARXIV_CACHE_DIR, run_24.get_arxiv_pdf_url
+        run_24.ARXIV_CACHE_DIR = self.cache_dir.name
+
+    def tearDown(self):
+        run_24.ARXIV_CACHE_DIR, run_24.get_arxiv_pdf_url = self.saved
+        self.cache_dir.cleanup()
+
+    def test_extracts_text_and_skips_missing_papers(self):
+        routes = {
+            "/2101.00001v1.pdf": [(200, build_pdf("First sample paper"))],
+            "/2101.00002v1.pdf": [(200, build_pdf("Second sample paper"))],
+        }
+        readme = "\n".join(f"https://arxiv.org/abs/{paper}" for paper in ("2101.00001v1", "2101.00002v1", "2101.00003v1"))
+        with PdfServer(routes) as server:
+            run_24.get_arxiv_pdf_url = lambda paper_id, version="": server.url(f"/{paper_id}{version}.pdf")
+            text = download_and_extract_arxiv_pdfs(readme)
+            self.assertIn("First sample paper", text)
+            self.assertIn("Second sample paper", text)
+            self.assertEqual(server.requests["/2101.00003v1.pdf"], 1)
+            # 두 번째 실행은 캐시에서 읽는다
+            self.assertEqual(download_and_extract_arxiv_pdfs(readme), text)
+            self.assertEqual(server.requests["/2101.00001v1.pdf"], 1)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
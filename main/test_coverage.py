@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+import run_24
+from run_24 import DirectorySource, measure_coverage, is_high_coverage
+
+
+# 작은 패키지와 그 테스트. full은 모두 테스트되고, partial은 함수 두 개 중 하나만, unused는 아무도 import하지 않는다
+FIXTURE_FILES = {
+    "pkg/__init__.py": "",
+    "pkg/full.py": "def add(x, y):\n    return x + y\n",
+    "pkg/partial.py": "def tested(x):\n    return x + 1\n\n\ndef untested(x):\n    y = x * 2\n    return y - 1\n",
+    "pkg/unused.py": "def unused(x):\n    return x\n",
+    "tests/test_full.py": "from pkg.full import add\n\n\ndef test_add():\n    assert add(1, 2) == 3\n",
+    "tests/test_partial.py": "from pkg.partial import tested\n\n\ndef test_tested():\n    assert tested(1) == 2\n",
+}
+HANGING_TEST = "import time\n\n\ndef test_hanging():\n    time.sleep(3600)\n"
+
+
+def build_fixture_repo(root, files):
+    for file_path, content in files.items():
+        path = os.path.join(root, file_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+    return list(files)
+
+
+class MeasureCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.repo_dir = os.path.join(self.work_dir.name, "repo")
+        self.workspace = os.path.join(self.work_dir.name, "workspace")
+        self.saved_timeout = run_24.COVERAGE_TIMEOUT
+
+    def tearDown(self):
+        run_24.COVERAGE_TIMEOUT = self.saved_timeout
+        self.work_dir.cleanup()
+
+    def measure(self, files, workers=2):
+        file_paths = build_fixture_repo(self.repo_dir, files)
+        return measure_coverage(DirectorySource(self.repo_dir), file_paths, self.repo_dir, self.workspace, workers=workers)
+
+    def test_per_file_ratios(self):
+        ratios, stats = self.measure(FIXTURE_FILES)
+        self.assertEqual(stats["mode"], "tests")
+        self.assertEqual(stats["timeouts"], 0)
+        self.assertEqual(ratios["pkg/full.py"], 1.0)
+        self.assertAlmostEqual(ratios["pkg/partial.py"], 0.6)
+        self.assertEqual(ratios.get("pkg/unused.py", 0.0), 0.0)
+        self.assertTrue(is_high_coverage("pkg/full.py", ratios))
+        self.assertFalse(is_high_coverage("pkg/partial.py", ratios))
+
+    def test_test_files_and_empty_modules_are_left_out(self):
+        ratios, _ = self.measure(FIXTURE_FILES)
+        self.assertNotIn("pkg/__init__.py", ratios)
+        self.assertNotIn("tests/test_full.py", ratios)
+        self.assertNotIn("tests/test_partial.py", ratios)
+        self.assertFalse(is_high_coverage("pkg/__init__.py", ratios))
+        self.assertFalse(is_high_coverage("tests/test_full.py", ratios))
+
+    def test_hanging_test_is_killed_at_timeout(self):
+        run_24.COVERAGE_TIMEOUT = 10
+        # 작업마다 테스트 파일 하나씩이라 다른 테스트의 결과는 남는다
+        ratios, stats = self.measure({**FIXTURE_FILES, "tests/test_hanging.py": HANGING_TEST}, workers=3)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(ratios["pkg/full.py"], 1.0)
+        self.assertAlmostEqual(ratios["pkg/partial.py"], 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()